@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    Dispatch Benchmark
+    ~~~~~~~~~~~~~~~~~~
+
+    Compares the requests per second of the regular dispatching with
+    the compiled dispatch table (:attr:`flask.Flask.compiled_dispatch`).
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import flask
+from werkzeug import create_environ
+
+
+REQUESTS = 20000
+
+
+def make_app(compiled):
+    app = flask.Flask(__name__)
+    app.compiled_dispatch = compiled
+    admin = flask.Module(__name__, 'admin', url_prefix='/admin')
+    @admin.before_request
+    def before_admin_request():
+        pass
+    @admin.after_request
+    def after_admin_request(response):
+        return response
+    @admin.route('/<int:id>')
+    def show(id):
+        return 'item %d' % id
+    @app.before_request
+    def before_request():
+        pass
+    @app.after_request
+    def after_request(response):
+        return response
+    app.register_module(admin)
+    return app
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def bench(app, path):
+    environ = create_environ(path)
+    start = time()
+    for x in xrange(REQUESTS):
+        app(environ.copy(), start_response)
+    return REQUESTS / (time() - start)
+
+
+def main():
+    for compiled in False, True:
+        rps = bench(make_app(compiled), '/admin/42')
+        print '%-20s %10.1f req/s' % (compiled and 'compiled' or 'regular',
+                                      rps)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    Request Hook Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the per-request overhead of running the before and after
+    request functions for 0, 5 and 20 registered hooks.  Half of the hooks
+    are registered on the application, the other half on a module.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import flask
+
+
+ROUNDS = 20000
+
+
+def make_app(hooks):
+    app = flask.Flask(__name__)
+    admin = flask.Module(__name__, 'admin', url_prefix='/admin')
+    for x in xrange(hooks):
+        target = x % 2 and admin or app
+        target.before_request(lambda: None)
+        target.after_request(lambda response: response)
+    admin.add_url_rule('/', 'index', lambda: '')
+    app.register_module(admin)
+    return app
+
+
+def bench(app):
+    with app.test_request_context('/admin/'):
+        response = app.response_class()
+        start = time()
+        for x in xrange(ROUNDS):
+            app.preprocess_request()
+            app.process_response(response)
+        return (time() - start) / ROUNDS * 1000000
+
+
+def main():
+    for hooks in 0, 5, 20:
+        print '%3d hooks: %6.2f us per request' % (hooks,
+                                                   bench(make_app(hooks)))
+
+
+if __name__ == '__main__':
+    main()
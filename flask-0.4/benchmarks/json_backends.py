@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+    JSON Backend Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the JSON modules that are installed as :class:`flask.JSONBackend`
+    on a large payload, once compact as :func:`flask.jsonify` sends it by
+    default and once indented as it was sent before.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+from time import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import flask
+
+
+ROUNDS = 20
+
+
+def make_payload(rows):
+    return {'messages': [{
+        'message_id': x,
+        'author_id': x % 100,
+        'username': u'user%d' % (x % 100),
+        'email': u'user%d@example.com' % (x % 100),
+        'text': u'This is message number %d.' % x,
+        'pub_date': datetime(2010, 7, 1, 12, x % 60),
+        'tags': [u'flask', u'benchmark'],
+        'public': bool(x % 2)
+    } for x in xrange(rows)]}
+
+
+def get_modules():
+    rv = []
+    for name in 'json', 'simplejson':
+        try:
+            rv.append((name, __import__(name)))
+        except ImportError:
+            pass
+    return rv
+
+
+def bench(backend, payload, indent):
+    start = time()
+    for x in xrange(ROUNDS):
+        rv = backend.dumps(payload, indent=indent)
+    return (time() - start) / ROUNDS * 1000, len(rv)
+
+
+def main():
+    payload = make_payload(10000)
+    for name, module in get_modules():
+        backend = flask.JSONBackend(module)
+        for indent in None, 2:
+            ms, size = bench(backend, payload, indent)
+            print '%-10s %-8s %8.2f ms %9d bytes' % (
+                name, indent and 'indented' or 'compact', ms, size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+    Routing Benchmark
+    ~~~~~~~~~~~~~~~~~
+
+    Compares URL matching of the plain :class:`~werkzeug.routing.Map` with
+    the prefix index (:attr:`flask.Flask.url_prefix_index`) for 10, 100
+    and 1000 rules.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import flask
+from werkzeug import create_environ
+
+
+MATCHES = 5000
+
+
+def make_app(rules, indexed):
+    app = flask.Flask(__name__)
+    app.url_prefix_index = indexed
+    view = lambda **kwargs: ''
+    for x in xrange(rules // 2):
+        app.add_url_rule('/section%d/' % x, 'section%d' % x, view)
+        app.add_url_rule('/section%d/<int:id>' % x, 'item%d' % x, view)
+    return app
+
+
+def bench(app, rules):
+    # match the last rules, that's the worst case for the plain map
+    environ = create_environ('/section%d/42' % (rules // 2 - 1))
+    adapter = app.create_url_adapter(environ)
+    start = time()
+    for x in xrange(MATCHES):
+        adapter.match(environ['PATH_INFO'], 'GET')
+    return (time() - start) / MATCHES * 1000000
+
+
+def main():
+    for rules in 10, 100, 1000:
+        plain = bench(make_app(rules, False), rules)
+        indexed = bench(make_app(rules, True), rules)
+        print '%5d rules: %8.1f us plain %8.1f us indexed' % (rules, plain,
+                                                              indexed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    Session Serializer Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the cookie size and the time needed to save and load cookie
+    based sessions with the default pickle serialization, the
+    :class:`flask.TaggedJSONSerializer` and the compressed JSON variant.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import flask
+
+
+ROUNDS = 2000
+
+PAYLOADS = [
+    ('user id', {'user_id': 42, '_permanent': True}),
+    ('flashes', {'user_id': 42, '_flashes': [
+        ('message', u'You were logged in'),
+        ('message', u'Your message was recorded'),
+        ('error', u'You are not following "someone"'),
+    ]}),
+    ('many flashes', {'user_id': 42, '_flashes': [
+        ('message', u'Your message was recorded')] * 20}),
+]
+
+SERIALIZERS = [
+    ('pickle', None),
+    ('json', flask.TaggedJSONSerializer()),
+    ('json+zlib', flask.CompressedSerializer(flask.TaggedJSONSerializer())),
+]
+
+
+def bench(serializer, payload):
+    app = flask.Flask(__name__)
+    app.secret_key = 'benchmark key'
+    app.session_serializer = serializer
+    session_class = app.session_interface.get_session_class(app)
+    session = session_class(payload, app.secret_key)
+    start = time()
+    for x in xrange(ROUNDS):
+        data = session.serialize()
+    save = (time() - start) / ROUNDS * 1000000
+    start = time()
+    for x in xrange(ROUNDS):
+        session_class.unserialize(data, app.secret_key)
+    load = (time() - start) / ROUNDS * 1000000
+    return len(data), save, load
+
+
+def main():
+    for name, payload in PAYLOADS:
+        print name
+        for serializer_name, serializer in SERIALIZERS:
+            print '  %-10s %5d bytes %8.1f us save %8.1f us load' % (
+                (serializer_name,) + bench(serializer, payload))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+    Static File Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Compares serving a static file with werkzeug's
+    :class:`~werkzeug.SharedDataMiddleware` and with the
+    :class:`flask.StaticFileHandler`, for a full response and for a
+    conditional request answered with ``304 Not Modified``.
+
+    :copyright: (c) 2010 by Armin Ronacher.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import flask
+from werkzeug import SharedDataMiddleware, create_environ
+
+
+REQUESTS = 5000
+STATIC_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                             'static')
+
+
+def make_app(native):
+    app = flask.Flask(__name__)
+    if native:
+        app.static_files.directory = STATIC_FOLDER
+    else:
+        app.wsgi_app = SharedDataMiddleware(app.static_files.wsgi_app, {
+            app.static_path: STATIC_FOLDER
+        })
+    return app
+
+
+def bench(app, headers=None):
+    environ = create_environ('/static/index.html', headers=headers)
+    def start_response(status, headers):
+        pass
+    start = time()
+    for x in xrange(REQUESTS):
+        app_iter = app(environ.copy(), start_response)
+        for chunk in app_iter:
+            pass
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    return (time() - start) / REQUESTS * 1000000
+
+
+def main():
+    for native in False, True:
+        app = make_app(native)
+        etag = flask.Response.force_type(app, create_environ(
+            '/static/index.html')).headers['ETag']
+        full = bench(app)
+        cached = bench(app, [('If-None-Match', etag)])
+        print '%-20s %6.1f us full %6.1f us not modified' % (
+            native and 'StaticFileHandler' or 'SharedDataMiddleware',
+            full, cached)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,18 +13,30 @@
 """
 from __future__ import with_statement
 import os
+import re
 import sys
+import zlib
+import tempfile
+import posixpath
 import mimetypes
+from io import UnsupportedOperation
+from time import time
+from hashlib import md5
+from calendar import timegm
+from functools import update_wrapper
 from datetime import datetime, timedelta
 
-from itertools import chain
 from threading import Lock  # 日志记录器 专用锁 - 引用
-from jinja2 import Environment, PackageLoader, FileSystemLoader
+from threading import local
+from jinja2 import Environment, PackageLoader, FileSystemLoader, \
+     BytecodeCache, contextfunction
 from werkzeug import Request as RequestBase, Response as ResponseBase, \
      LocalStack, LocalProxy, create_environ, SharedDataMiddleware, \
      ImmutableDict, cached_property, wrap_file, Headers, \
-     import_string
-from werkzeug.routing import Map, Rule
+     import_string, quote_etag, is_resource_modified, http_date, \
+     parse_accept_header, unquote_etag, parse_etags, parse_date
+from werkzeug.local import get_ident
+from werkzeug.routing import Map, Rule, MapAdapter
 from werkzeug.exceptions import HTTPException, InternalServerError
 from werkzeug.contrib.securecookie import SecureCookie
 
@@ -40,10 +52,22 @@ except ImportError:
     except ImportError:
         json_available = False
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# sqlite3 is only needed for the SQLite session store and might not be
+# compiled into the interpreter.
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
 # utilities we import from Werkzeug and Jinja2 that are unused
 # in the module but are exported as public interface.
 from werkzeug import abort, redirect  # werkzeug 依赖：本模块未使用，但导入以作对外接口
-from jinja2 import Markup, escape  # jinja2 的依赖：本模块未使用，但导入以作对外接口
+from jinja2 import Markup, escape, FileSystemBytecodeCache
 
 # use pkg_resource if that works, otherwise fall back to cwd.
 # The current working directory is generally not reliable with the notable
@@ -98,6 +122,9 @@ class Request(RequestBase):
         if __debug__:
             _assert_have_json()
         if self.mimetype == 'application/json':
+            ctx = _request_ctx_stack.top
+            if ctx is not None:
+                return ctx.app.json_backend.loads(self.data)
             return json.loads(self.data)
 
 
@@ -117,20 +144,75 @@ class _RequestGlobals(object):
     pass
 
 
+# values of these types can be compared to find out if a write to the
+# session actually changes it.
+_immutable_session_types = (basestring, int, long, float, bool, type(None))
+
+
 class Session(SecureCookie):
     """Expands the session with support for switching between permanent
-    and non-permanent sessions.
+    and non-permanent sessions.  Writes that do not change the session,
+    like assigning an equal string or number or popping a missing key,
+    do not mark it as modified.  Changes inside mutable values are not
+    tracked, set :attr:`modified` to `True` by hand for those.
     """
 
+    #: The expiration date of the cookie the session was loaded from as
+    #: UNIX timestamp or `None` if it is unknown.
+    #:
+    #: .. versionadded:: 0.5
+    expires = None
+
     def _get_permanent(self):
         return self.get('_permanent', False)
 
     def _set_permanent(self, value):
-        self['_permanent'] = bool(value)
+        value = bool(value)
+        if self.get('_permanent', False) != value:
+            self['_permanent'] = value
 
     permanent = property(_get_permanent, _set_permanent)
     del _get_permanent, _set_permanent  # 删除这两个变量名对内存的引用，大概是防止外部引用
 
+    def __setitem__(self, key, value):
+        if isinstance(value, _immutable_session_types) and key in self:
+            old = dict.__getitem__(self, key)
+            if type(old) is type(value) and old == value:
+                return
+        SecureCookie.__setitem__(self, key, value)
+
+    def pop(self, key, *args):
+        if args and key not in self:
+            return args[0]
+        return SecureCookie.pop(self, key, *args)
+
+    def clear(self):
+        if self:
+            SecureCookie.clear(self)
+
+    def serialize(self, expires=None):
+        # the expiration date is stored under a key of our own because
+        # werkzeug drops its `_expires` key on load and we need it to find
+        # out when a permanent session has to be refreshed.
+        if expires is None:
+            return SecureCookie.serialize(self)
+        self.expires = timegm(expires.utctimetuple())
+        dict.__setitem__(self, '_expires_at', self.expires)
+        try:
+            return SecureCookie.serialize(self)
+        finally:
+            dict.pop(self, '_expires_at', None)
+
+    @classmethod
+    def unserialize(cls, string, secret_key):
+        rv = super(Session, cls).unserialize(string, secret_key)
+        expires = dict.pop(rv, '_expires_at', None)
+        if expires is not None:
+            if time() > expires:
+                return cls(None, secret_key, False)
+            rv.expires = expires
+        return rv
+
 
 class _NullSession(Session):
     """Class used to generate nicer error messages if sessions are not
@@ -150,6 +232,952 @@ class _NullSession(Session):
     del _fail
 
 
+# session ids handed out by the StoreSessionInterface
+_session_id_re = re.compile(r'^[a-f0-9]{40}$')
+
+
+class SessionInterface(object):
+    """The interface Flask uses to open and save sessions.  The default
+    implementation is :class:`SecureCookieSessionInterface`.  To replace
+    it, set :attr:`Flask.session_interface` to an instance of your own
+    subclass.
+
+    .. versionadded:: 0.5
+    """
+
+    def open_session(self, app, request):
+        """Returns the session for the request or `None` if sessions are
+        not available.  The session has to behave like :class:`Session`.
+        """
+        raise NotImplementedError()
+
+    def save_session(self, app, session, response):
+        """Saves the session and updates the response if necessary."""
+        raise NotImplementedError()
+
+
+class SecureCookieSessionInterface(SessionInterface):
+    """Stores all session data in a cookie signed with the application's
+    :attr:`~Flask.secret_key`.  Sessions are unavailable if no secret key
+    is set.  The values are serialized with the application's
+    :attr:`~Flask.session_serializer`.
+
+    .. versionadded:: 0.5
+    """
+
+    def __init__(self):
+        self._session_classes = {}
+
+    def get_session_class(self, app):
+        """Returns the :class:`Session` subclass that uses the session
+        serializer of the application.
+        """
+        serializer = app.session_serializer
+        if serializer is None:
+            return Session
+        rv = self._session_classes.get(serializer)
+        if rv is None:
+            rv = self._session_classes[serializer] = type('Session',
+                (Session,), {'serialization_method': serializer})
+        return rv
+
+    def open_session(self, app, request):
+        key = app.secret_key
+        if key is not None:
+            return self.get_session_class(app).load_cookie(request,
+                app.session_cookie_name, secret_key=key)
+
+    def save_session(self, app, session, response):
+        expires = None
+        if session.permanent:
+            expires = datetime.utcnow() + app.permanent_session_lifetime
+        session.save_cookie(response, app.session_cookie_name,
+                            expires=expires, httponly=True, force=True)
+
+
+# values of these types are stored as plain JSON by the tagged serializer
+_untagged_json_types = frozenset([unicode, int, long, float, bool,
+                                  type(None)])
+
+
+class TaggedJSONSerializer(object):
+    """A session serializer that produces compact JSON.  Tuples,
+    datetimes, :class:`~jinja2.Markup` strings and byte strings that are
+    not valid UTF-8 are stored as tagged objects so that they are restored
+    with the right type.  Like all JSON, dictionaries can only have string
+    keys.  To use it for the sessions of an application::
+
+        app.session_serializer = TaggedJSONSerializer()
+
+    .. versionadded:: 0.5
+    """
+
+    def __init__(self):
+        if __debug__:
+            _assert_have_json()
+
+    def _tag(self, value):
+        if value.__class__ in _untagged_json_types:
+            return value
+        elif isinstance(value, tuple):
+            return {' t': [self._tag(x) for x in value]}
+        elif isinstance(value, Markup):
+            return {' m': unicode(value)}
+        elif isinstance(value, str):
+            try:
+                value.decode('utf-8')
+            except UnicodeError:
+                return {' b': value.encode('base64')}
+        elif isinstance(value, list):
+            return [self._tag(x) for x in value]
+        elif isinstance(value, dict):
+            # keys starting with a space are escaped with another space so
+            # that they cannot be mistaken for tags.
+            return dict((k[:1] == ' ' and ' ' + k or k, self._tag(v))
+                        for k, v in value.iteritems())
+        elif isinstance(value, datetime):
+            return {' d': [value.year, value.month, value.day, value.hour,
+                           value.minute, value.second, value.microsecond]}
+        return value
+
+    def _untag(self, obj):
+        if len(obj) == 1:
+            key, value = obj.items()[0]
+            if key == ' t':
+                return tuple(value)
+            elif key == ' m':
+                return Markup(value)
+            elif key == ' b':
+                return value.decode('base64')
+            elif key == ' d':
+                return datetime(*value)
+        return dict((k[:1] == ' ' and k[1:] or k, v)
+                    for k, v in obj.iteritems())
+
+    def dumps(self, value):
+        return json.dumps(self._tag(value), separators=(',', ':'))
+
+    def loads(self, string):
+        return json.loads(string, object_hook=self._untag)
+
+
+class CompressedSerializer(object):
+    """Wraps another session serializer and compresses its output with
+    zlib if it is longer than `threshold` bytes and compression actually
+    makes it shorter.  Compressed values are marked with a leading dot
+    which neither JSON nor pickle produce::
+
+        app.session_serializer = CompressedSerializer(TaggedJSONSerializer())
+
+    .. versionadded:: 0.5
+
+    :param serializer: the serializer to wrap.
+    :param threshold: values up to this length are not compressed.
+    :param level: the zlib compression level.
+    """
+
+    def __init__(self, serializer, threshold=128, level=6):
+        self.serializer = serializer
+        self.threshold = threshold
+        self.level = level
+
+    def dumps(self, value):
+        rv = self.serializer.dumps(value)
+        if len(rv) > self.threshold:
+            compressed = zlib.compress(rv, self.level)
+            if len(compressed) + 1 < len(rv):
+                return '.' + compressed
+        return rv
+
+    def loads(self, string):
+        if string[:1] == '.':
+            string = zlib.decompress(string[1:])
+        return self.serializer.loads(string)
+
+
+class StoreSessionInterface(SessionInterface):
+    """Keeps the session data on the server in a session store and only
+    puts a random session id into the cookie.  The store has to implement
+    the interface of :class:`SessionStore`::
+
+        app.session_interface = StoreSessionInterface(
+            FileSessionStore('/var/lib/myapp/sessions'))
+
+    Data of non-permanent sessions is kept for the
+    :attr:`~Flask.permanent_session_lifetime` as well, the cookie however
+    only lives until the browser is closed.
+
+    .. versionadded:: 0.5
+
+    :param store: the session store to keep the data in.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def generate_sid(self):
+        """Returns a new random session id."""
+        return os.urandom(20).encode('hex')
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid and _session_id_re.match(sid) is not None:
+            rv = self.store.load(sid)
+            if rv is not None:
+                data, expires = rv
+                session = Session(data, new=False)
+                session.sid = sid
+                session.expires = expires
+                return session
+        session = Session()
+        session.sid = self.generate_sid()
+        return session
+
+    def save_session(self, app, session, response):
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name)
+            return
+        expires = datetime.utcnow() + app.permanent_session_lifetime
+        self.store.save(session.sid, dict(session),
+                        timegm(expires.utctimetuple()))
+        if session.permanent:
+            response.set_cookie(app.session_cookie_name, session.sid,
+                                expires=expires, httponly=True)
+        elif session.new:
+            response.set_cookie(app.session_cookie_name, session.sid,
+                                httponly=True)
+
+
+class SessionStore(object):
+    """Base class for the stores of :class:`StoreSessionInterface`.  The
+    session data is a dictionary, the expiration date a UNIX timestamp.
+
+    .. versionadded:: 0.5
+    """
+
+    def load(self, sid):
+        """Returns the data and expiration date as tuple for the session
+        id or `None` if the session does not exist or expired.
+        """
+        raise NotImplementedError()
+
+    def save(self, sid, data, expires):
+        """Stores the data for the session id until `expires`."""
+        raise NotImplementedError()
+
+    def delete(self, sid):
+        """Removes the session with the given id if it exists."""
+        raise NotImplementedError()
+
+    def sweep(self, batch_size=None):
+        """Removes expired sessions and returns how many were removed.  If
+        a `batch_size` is given at most that many sessions are removed so
+        that the sweep can be spread over time.
+        """
+        raise NotImplementedError()
+
+
+class MemorySessionStore(SessionStore):
+    """Keeps the sessions in the memory of the process.  If more than
+    `capacity` sessions exist, the least recently used one is dropped.
+    This is only useful for single process deployments.
+
+    .. versionadded:: 0.5
+
+    :param capacity: the maximum number of sessions kept.
+    """
+
+    def __init__(self, capacity=10000):
+        self._cache = _LRUCache(capacity)
+
+    def load(self, sid):
+        rv = self._cache.get(sid)
+        if rv is None:
+            return None
+        data, expires = rv
+        if expires < time():
+            self._cache.pop(sid)
+            return None
+        return pickle.loads(data), expires
+
+    def save(self, sid, data, expires):
+        # the data is pickled so that no mutable objects are shared
+        # between requests.
+        self._cache[sid] = (pickle.dumps(data, 2), expires)
+
+    def delete(self, sid):
+        self._cache.pop(sid)
+
+    def sweep(self, batch_size=None):
+        now = time()
+        removed = 0
+        for sid, (data, expires) in self._cache.items():
+            if batch_size is not None and removed >= batch_size:
+                break
+            if expires < now:
+                self._cache.pop(sid)
+                removed += 1
+        return removed
+
+
+class FileSessionStore(SessionStore):
+    """Keeps every session in a file below `path`.  The files are spread
+    over subfolders named after the first two characters of the session
+    id so that no folder has to hold all the sessions.  The modification
+    time of a file is set to the expiration date of the session so that
+    :meth:`sweep` does not have to read the files.
+
+    .. versionadded:: 0.5
+
+    :param path: the folder the sessions are stored in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_session_filename(self, sid):
+        """Returns the filename for the session with the given id."""
+        return os.path.join(self.path, sid[:2], sid)
+
+    def load(self, sid):
+        try:
+            f = open(self.get_session_filename(sid), 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                expires, data = pickle.load(f)
+            except Exception:
+                return None
+        finally:
+            f.close()
+        if expires < time():
+            return None
+        return data, expires
+
+    def save(self, sid, data, expires):
+        filename = self.get_session_filename(sid)
+        folder = os.path.dirname(filename)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # another process might have created it meanwhile
+                if not os.path.isdir(folder):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=folder)
+        f = os.fdopen(fd, 'wb')
+        try:
+            pickle.dump((expires, data), f, 2)
+        finally:
+            f.close()
+        os.utime(tmp, (expires, expires))
+        try:
+            os.rename(tmp, filename)
+        except OSError:
+            # windows does not replace existing files on rename
+            self.delete(sid)
+            os.rename(tmp, filename)
+
+    def delete(self, sid):
+        try:
+            os.remove(self.get_session_filename(sid))
+        except OSError:
+            pass
+
+    def sweep(self, batch_size=None):
+        now = time()
+        removed = 0
+        if not os.path.isdir(self.path):
+            return removed
+        for shard in os.listdir(self.path):
+            folder = os.path.join(self.path, shard)
+            if not os.path.isdir(folder):
+                continue
+            for sid in os.listdir(folder):
+                if batch_size is not None and removed >= batch_size:
+                    return removed
+                filename = os.path.join(folder, sid)
+                try:
+                    if os.stat(filename).st_mtime < now:
+                        os.remove(filename)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+class SQLiteSessionStore(SessionStore):
+    """Keeps the sessions in a table of an SQLite database.  Every thread
+    uses its own connection to the database.
+
+    .. versionadded:: 0.5
+
+    :param filename: the filename of the database.
+    :param table: the name of the table the sessions are stored in.  It
+                  is created if it does not exist yet.
+    """
+
+    def __init__(self, filename, table='sessions'):
+        if sqlite3 is None:
+            raise RuntimeError('sqlite3 is not available')
+        self.filename = filename
+        self.table = table
+        self._local = local()
+        db = self._connect()
+        db.execute('create table if not exists %s (sid text primary key, '
+                   'expires integer not null, data blob not null)' % table)
+        db.execute('create index if not exists %s_expires on %s '
+                   '(expires)' % (table, table))
+        db.commit()
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.filename)
+        return db
+
+    def load(self, sid):
+        row = self._connect().execute('select data, expires from %s where '
+                                      'sid = ? and expires >= ?' % self.table,
+                                      (sid, time())).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(str(row[0])), row[1]
+
+    def save(self, sid, data, expires):
+        db = self._connect()
+        db.execute('insert or replace into %s (sid, expires, data) values '
+                   '(?, ?, ?)' % self.table, (sid, expires,
+                   sqlite3.Binary(pickle.dumps(data, 2))))
+        db.commit()
+
+    def delete(self, sid):
+        db = self._connect()
+        db.execute('delete from %s where sid = ?' % self.table, (sid,))
+        db.commit()
+
+    def sweep(self, batch_size=None):
+        db = self._connect()
+        if batch_size is None:
+            cur = db.execute('delete from %s where expires < ?' % self.table,
+                             (time(),))
+        else:
+            cur = db.execute('delete from %s where sid in (select sid from '
+                             '%s where expires < ? limit ?)' %
+                             (self.table, self.table), (time(), batch_size))
+        db.commit()
+        return cur.rowcount
+
+
+class _LRUCache(object):
+    """A small thread safe mapping that holds at most `capacity` items and
+    discards the least recently used item if it runs full.  If `max_size`
+    is given, items are also discarded once the sizes of all items as
+    returned by `sizeof` add up to more than that.
+    """
+
+    def __init__(self, capacity, max_size=None, sizeof=len):
+        self.capacity = capacity
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self._mapping = {}
+        # the links of the doubly linked list are lists in the form
+        # ``[prev, next, key, value, size]``.  The root link is never
+        # removed.
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+        self._lock = Lock()
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        last[1] = root[0] = link
+        link[0] = last
+        link[1] = root
+
+    def get(self, key, default=None):
+        """Returns the value for `key` and marks it as recently used."""
+        with self._lock:
+            link = self._mapping.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+
+    def __setitem__(self, key, value):
+        size = 0
+        if self.max_size is not None:
+            size = self.sizeof(value)
+            if size > self.max_size:
+                self.pop(key)
+                return
+        with self._lock:
+            link = self._mapping.get(key)
+            if link is not None:
+                self._unlink(link)
+                self.size -= link[4]
+                link[3] = value
+                link[4] = size
+            else:
+                if len(self._mapping) >= self.capacity:
+                    self._discard_oldest()
+                link = [None, None, key, value, size]
+                self._mapping[key] = link
+            self.size += size
+            if self.max_size is not None:
+                while self.size > self.max_size:
+                    self._discard_oldest()
+            self._append(link)
+
+    def _discard_oldest(self):
+        oldest = self._root[1]
+        self._unlink(oldest)
+        del self._mapping[oldest[2]]
+        self.size -= oldest[4]
+
+    def pop(self, key, default=None):
+        """Removes `key` and returns its value or `default`."""
+        with self._lock:
+            link = self._mapping.pop(key, None)
+            if link is None:
+                return default
+            self._unlink(link)
+            self.size -= link[4]
+            return link[3]
+
+    def items(self):
+        """Returns a list of all items, the least recently used first."""
+        with self._lock:
+            rv = []
+            link = self._root[1]
+            while link is not self._root:
+                rv.append((link[2], link[3]))
+                link = link[1]
+            return rv
+
+    def clear(self):
+        """Removes all items."""
+        with self._lock:
+            self._mapping.clear()
+            self.size = 0
+            root = self._root
+            root[:] = [root, root, None, None, 0]
+
+    def __contains__(self, key):
+        return key in self._mapping
+
+    def __len__(self):
+        return len(self._mapping)
+
+
+class MemoryBytecodeCache(BytecodeCache):
+    """A Jinja2 bytecode cache that keeps the compiled templates in the
+    memory of the process.  Unlike the template cache of the environment
+    it holds many more templates as it only stores the marshalled code,
+    so templates that fell out of the environment's cache do not have to
+    be compiled from source again.  For a cache that survives restarts
+    and is shared between worker processes use the
+    :class:`~jinja2.FileSystemBytecodeCache` instead.
+
+    .. versionadded:: 0.5
+
+    :param capacity: the maximum number of compiled templates kept.
+    """
+
+    def __init__(self, capacity=1000):
+        self._cache = _LRUCache(capacity)
+
+    def load_bytecode(self, bucket):
+        code = self._cache.get(bucket.key)
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        self._cache[bucket.key] = bucket.bytecode_to_string()
+
+    def clear(self):
+        self._cache.clear()
+
+
+class FragmentCache(object):
+    """Caches rendered fragments of pages in the memory of the process.
+    Every fragment is stored under a key that is a tuple and expires after
+    a timeout.  If more than `capacity` fragments are cached, the least
+    recently used one is dropped.
+
+    The cache of an application is available as
+    :attr:`Flask.fragment_cache`.  From Python code it is used like this::
+
+        def render_timeline():
+            return render_template('_timeline.html', messages=...)
+
+        timeline = app.fragment_cache.get_or_set(('timeline',),
+                                                 render_timeline)
+
+    In templates the `cache_fragment` function caches the body of a call
+    block under the name of the rendered template and the arguments::
+
+        {% call cache_fragment('navigation', timeout=60) %}
+          ...
+        {% endcall %}
+
+    That fragment is stored under ``('index.html', 'navigation')`` if
+    rendered as part of the `index.html` template, even if the block is
+    defined in a layout template `index.html` extends.
+
+    .. versionadded:: 0.5
+
+    :param capacity: the maximum number of fragments kept.
+    :param default_timeout: the number of seconds a fragment is cached if
+                            no timeout is given.  ``0`` caches fragments
+                            until they are removed.
+    """
+
+    def __init__(self, capacity=1000, default_timeout=300):
+        self._cache = _LRUCache(capacity)
+        self.default_timeout = default_timeout
+
+    def get(self, key):
+        """Returns the fragment for `key` or `None` if it is not cached
+        or expired.
+        """
+        rv = self._cache.get(key)
+        if rv is None:
+            return None
+        value, expires = rv
+        if expires is not None and expires < time():
+            self._cache.pop(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        """Caches `value` under `key` for `timeout` seconds."""
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = None
+        if timeout:
+            expires = time() + timeout
+        self._cache[key] = (value, expires)
+
+    def get_or_set(self, key, func, timeout=None):
+        """Returns the fragment for `key`.  If it is not cached `func` is
+        called to create it and the return value is cached.
+        """
+        rv = self.get(key)
+        if rv is None:
+            rv = func()
+            self.set(key, rv, timeout)
+        return rv
+
+    def delete(self, key):
+        """Removes the fragment for `key` from the cache."""
+        self._cache.pop(key)
+
+    def clear(self):
+        """Removes all fragments from the cache."""
+        self._cache.clear()
+
+
+@contextfunction
+def _cache_fragment(context, *args, **kwargs):
+    """Caches the body of a call block in the fragment cache of the current
+    application.  See :class:`FragmentCache`.
+    """
+    return current_app.fragment_cache.get_or_set((context.name,) + args,
+                                                 kwargs['caller'],
+                                                 kwargs.get('timeout'))
+
+
+def _sizeof_response_entry(entry):
+    """Approximates the memory used by an entry of the response cache."""
+    rv = len(entry[2]) + 100
+    if entry[1] is not None:
+        for key, value in entry[1]:
+            rv += len(key) + len(value)
+    return rv
+
+
+class ResponseCache(object):
+    """Caches whole responses in the memory of the process.  The cache
+    holds at most `max_size` bytes of response bodies and headers, if it
+    runs full the least recently used responses are dropped.  Views opt in
+    to the cache with the :func:`cache_response` decorator.
+
+    If a cached response sets the `Vary` header, the values of the request
+    headers listed there become part of the key, so different variants of
+    a page are cached separately.
+
+    The cache of an application is available as
+    :attr:`Flask.response_cache`.
+
+    .. versionadded:: 0.5
+
+    :param max_size: the maximum number of bytes kept.
+    :param default_timeout: the number of seconds a response is cached if
+                            no timeout is given.  ``0`` caches responses
+                            until they are removed.
+    """
+
+    def __init__(self, max_size=10 * 1024 * 1024, default_timeout=300):
+        self._cache = _LRUCache(sys.maxint, max_size, _sizeof_response_entry)
+        self.default_timeout = default_timeout
+
+    def _get_entry(self, key):
+        rv = self._cache.get(key)
+        if rv is not None and rv[3] is not None and rv[3] < time():
+            self._cache.pop(key)
+            return None
+        return rv
+
+    def get(self, key, headers):
+        """Returns the response cached for `key` or `None`.  `headers`
+        are the headers of the request and used to pick the right variant
+        of a response that sets the `Vary` header.
+        """
+        vary = self._get_entry((key, None))
+        if vary is None:
+            return None
+        if vary[2]:
+            key = (key, tuple(headers.get(x) for x in vary[2]))
+        entry = self._get_entry((key, ()))
+        if entry is None:
+            return None
+        return current_app.response_class(entry[2], status=entry[0],
+                                          headers=entry[1])
+
+    def set(self, key, headers, response, timeout=None):
+        """Caches `response` for `timeout` seconds.  Only complete responses
+        with a ``200`` status code that do not set cookies and fit into the
+        cache are cached.  Returns `True` if the response was cached.
+        """
+        if response.status_code != 200 or response.direct_passthrough or \
+           not response.is_sequence or 'Set-Cookie' in response.headers:
+            return False
+        vary = tuple(x.strip().lower() for x in
+                     response.headers.get('Vary', '').split(',')
+                     if x.strip())
+        if '*' in vary:
+            return False
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = None
+        if timeout:
+            expires = time() + timeout
+        # the variants of a key are remembered with an entry that has
+        # the names of the headers instead of a body.
+        self._cache[(key, None)] = (None, None, vary, expires)
+        if vary:
+            key = (key, tuple(headers.get(x) for x in vary))
+        self._cache[(key, ())] = (response.status_code,
+                                  response.headers.to_list(),
+                                  response.data, expires)
+        # responses larger than the cache are not stored
+        return (key, ()) in self._cache
+
+    def clear(self):
+        """Removes all responses from the cache."""
+        self._cache.clear()
+
+
+class _RuleSubset(object):
+    """Looks like the :class:`~werkzeug.routing.Map` it wraps but only
+    exposes a subset of its rules for matching.
+    """
+
+    def __init__(self, map, rules):
+        self._map = map
+        self._rules = rules
+
+    def update(self):
+        # the prefix index updates the map before handing out subsets
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._map, name)
+
+
+class _PrefixIndex(object):
+    """Indexes the rules of a :class:`~werkzeug.routing.Map` by the literal
+    path segments they start with.  Each node of the trie knows the rules
+    that can possibly match a path below it in the order the map would try
+    them, so only those have to be matched against the regular expressions.
+    """
+
+    def __init__(self, map):
+        self.map = map
+        self._rule_count = None
+        self._root = None
+
+    def _literal_segments(self, rule):
+        static = rule.rule.lstrip('/')
+        has_converter = '<' in static
+        parts = static.split('<', 1)[0].split('/')
+        # the last part is either empty (trailing slash) or continues with
+        # a converter.  In both cases it cannot be used for the lookup.
+        if has_converter or not parts[-1]:
+            parts.pop()
+        return parts
+
+    def _build(self):
+        root = ({}, [])
+        for idx, rule in enumerate(self.map._rules):
+            node = root
+            for part in self._literal_segments(rule):
+                node = node[0].setdefault(part, ({}, []))
+            node[1].append((idx, rule))
+        def finalize(node, inherited):
+            own = sorted(inherited + node[1])
+            children = dict((part, finalize(child, own))
+                            for part, child in node[0].iteritems())
+            return children, _RuleSubset(self.map, [x[1] for x in own])
+        self._root = finalize(root, [])
+        self._rule_count = len(self.map._rules)
+
+    def lookup(self, path_info):
+        """Returns the rules that can match `path_info` as a map subset."""
+        self.map.update()
+        if self._rule_count != len(self.map._rules):
+            self._build()
+        children, subset = self._root
+        for part in path_info.lstrip('/').split('/'):
+            node = children.get(part)
+            if node is None:
+                break
+            children, subset = node
+        return subset
+
+
+class _PrefixIndexAdapter(MapAdapter):
+    """A :class:`~werkzeug.routing.MapAdapter` that uses a
+    :class:`_PrefixIndex` to only try the rules behind the longest matching
+    literal prefix of the path.
+    """
+
+    def __init__(self, index, *args):
+        MapAdapter.__init__(self, index.map, *args)
+        self.index = index
+
+    def match(self, path_info=None, method=None, return_rule=False):
+        if path_info is None:
+            path_info = self.path_info
+        if not isinstance(path_info, unicode):
+            path_info = path_info.decode(self.map.charset, 'ignore')
+        subset = self.index.lookup(path_info)
+        return MapAdapter(subset, self.server_name, self.script_name,
+                          self.subdomain, self.url_scheme, path_info,
+                          self.default_method).match(path_info, method,
+                                                     return_rule)
+
+
+class _DispatchRecord(object):
+    """Precomputed dispatch information for a single endpoint.  Instances
+    are created by :meth:`Flask.compile_dispatch` and hold everything the
+    request handling needs for the endpoint so that no hook chains have to
+    be assembled at request time.
+    """
+    __slots__ = ('view_func', 'before_request_funcs', 'after_request_funcs',
+                 'error_handlers')
+
+    def __init__(self, view_func, before_request_funcs, after_request_funcs,
+                 error_handlers):
+        self.view_func = view_func
+        self.before_request_funcs = before_request_funcs
+        self.after_request_funcs = after_request_funcs
+        self.error_handlers = error_handlers
+
+
+class _ContextStack(LocalStack):
+    """A :class:`~werkzeug.LocalStack` that tells contexts apart with a
+    replaceable ident function.  By default this is the ident function of
+    Werkzeug which uses the current thread and greenlet.  Servers that run
+    many requests cooperatively in one thread can set `__ident_func__` to
+    a function that returns a different identifier for each coroutine
+    that handles a request, for example ``greenlet.getcurrent``.  The
+    identifier has to stay the same while the request is handled.
+
+    Like the locals of newer Werkzeug versions the stack can be inspected
+    with `local_stats` and the contexts that dead threads left behind can
+    be released with `reap_local`.
+    """
+
+    def __init__(self, ident_func=None):
+        self._storage = {}
+        self._lock = Lock()
+        self.__ident_func__ = ident_func or get_ident
+
+    def __release_local__(self):
+        self._storage.pop(self.__ident_func__(), None)
+
+    def __local_stats__(self):
+        depths = dict((ident, len(stack))
+                      for ident, stack in self._storage.items())
+        return {'idents': len(depths), 'depths': depths}
+
+    def __reap_local__(self, live_threads):
+        # thread idents are checked against the running threads, dead
+        # greenlets are released as well.  Other idents are left alone.
+        self._lock.acquire()
+        try:
+            dead = []
+            for ident in self._storage.keys():
+                if isinstance(ident, (int, long)):
+                    if ident not in live_threads:
+                        dead.append(ident)
+                elif getattr(ident, 'dead', False):
+                    dead.append(ident)
+            for ident in dead:
+                del self._storage[ident]
+            return len(dead)
+        finally:
+            self._lock.release()
+
+    def push(self, obj):
+        """Pushes a new item to the stack"""
+        self._lock.acquire()
+        try:
+            rv = self._storage.setdefault(self.__ident_func__(), [])
+            rv.append(obj)
+            return rv
+        finally:
+            self._lock.release()
+
+    def pop(self):
+        """Removes the topmost item from the stack, will return the
+        old value or `None` if the stack was already empty.
+        """
+        self._lock.acquire()
+        try:
+            ident = self.__ident_func__()
+            stack = self._storage.get(ident)
+            if not stack:
+                return None
+            elif len(stack) == 1:
+                self._storage.pop(ident, None)
+            return stack.pop()
+        finally:
+            self._lock.release()
+
+    @property
+    def top(self):
+        """The topmost item on the stack.  If the stack is empty,
+        `None` is returned.
+        """
+        stack = self._storage.get(self.__ident_func__())
+        if stack:
+            return stack[-1]
+        return None
+
+
 class _RequestContext(object):
     """The request context contains all request relevant information.  It is
     created at the beginning of the request and pushed to the
@@ -163,21 +1191,46 @@ class _RequestContext(object):
 
     def __init__(self, app, environ):
         self.app = app
-        self.url_adapter = app.url_map.bind_to_environ(environ)
+        self.url_adapter = app.create_url_adapter(environ)
         self.request = app.request_class(environ)
 
         # 会话(session) 实现：
-        self.session = app.open_session(self.request)  # 关键代码：session 请求上下文的 session 对象
-        if self.session is None:
-            self.session = _NullSession()
+        # the session is opened on first access of :attr:`session` so that
+        # requests not using it do not pay for loading the cookie.
+        self._session = None
         self.g = _RequestGlobals()
         self.flashes = None
+        self.dispatch_record = None
+        self.template_context_cache = {}
+        self.response_version = None
 
         try:
             self.request.endpoint, self.request.view_args = \
-                self.url_adapter.match()
+                self.url_adapter.match(environ.get('PATH_INFO'),
+                                       environ['REQUEST_METHOD'])
         except HTTPException, e:
             self.request.routing_exception = e
+        else:
+            if app.compiled_dispatch:
+                self.dispatch_record = \
+                    app.get_dispatch_record(self.request.endpoint)
+
+    def _get_session(self):
+        rv = self._session
+        if rv is None:
+            rv = self.app.open_session(self.request)  # 关键代码：session 请求上下文的 session 对象
+            if rv is None:
+                rv = _NullSession()
+            self._session = rv
+        return rv
+
+    def _set_session(self, value):
+        self._session = value
+
+    session = property(_get_session, _set_session, doc="The session of "
+                       "the request.  It is opened by :meth:`Flask."
+                       "open_session` when accessed for the first time.")
+    del _get_session, _set_session
 
     def push(self):
         """Binds the request context."""
@@ -234,6 +1287,13 @@ def url_for(endpoint, **values):
     elif endpoint.startswith('.'):
         endpoint = endpoint[1:]
     external = values.pop('_external', False)
+    if endpoint == 'static' and ctx.app.static_fingerprints and \
+       ctx.app.static_files is not None and 'filename' in values:
+        values['filename'] = ctx.app.static_files \
+            .get_fingerprinted_filename(values['filename'])
+    if ctx.app.url_build_cache_size:
+        return ctx.app._cached_url_build(ctx.url_adapter, endpoint, values,
+                                         external)
     return ctx.url_adapter.build(endpoint, values, force_external=external)
 
 
@@ -306,6 +1366,64 @@ def get_flashed_messages(with_categories=False):
     return flashes
 
 
+class JSONBackend(object):
+    """Serializes the JSON sent by :func:`jsonify` and parses the JSON
+    available as :attr:`Request.json`.  The backend of an application is
+    stored as :attr:`Flask.json_backend` and created from
+    :attr:`Flask.json_backend_class`.
+
+    The output is compact unless an indentation is requested.  Objects
+    the JSON module does not know are converted by the encoder registered
+    for their type or one of its base classes.  By default datetimes are
+    converted to HTTP dates::
+
+        app.json_backend.add_encoder(Decimal, str)
+
+    .. versionadded:: 0.5
+
+    :param module: the JSON module to use.  It has to provide `dumps` and
+                   `loads` functions compatible with the :mod:`json` module
+                   of the standard library.  Defaults to :mod:`simplejson`
+                   if installed, otherwise :mod:`json`.
+    """
+
+    def __init__(self, module=None):
+        if module is None:
+            if __debug__:
+                _assert_have_json()
+            module = json
+        self.module = module
+        self.encoders = {datetime: http_date}
+
+    def add_encoder(self, type, func):
+        """Registers a function that converts objects of the given type to
+        something that can be serialized.
+        """
+        self.encoders[type] = func
+
+    def default(self, o):
+        """Converts an object the JSON module does not know with the encoder
+        registered for its type.  Raises :exc:`TypeError` if there is
+        none.
+        """
+        for cls in type(o).__mro__:
+            func = self.encoders.get(cls)
+            if func is not None:
+                return func(o)
+        raise TypeError('%r is not JSON serializable' % o)
+
+    def dumps(self, obj, indent=None):
+        """Serializes `obj` to a JSON formatted string."""
+        if indent is None:
+            return self.module.dumps(obj, default=self.default,
+                                     separators=(',', ':'))
+        return self.module.dumps(obj, default=self.default, indent=indent)
+
+    def loads(self, s):
+        """Parses a JSON formatted string."""
+        return self.module.loads(s)
+
+
 def jsonify(*args, **kwargs):
     """Creates a :class:`~flask.Response` with the JSON representation of
     the given arguments with an `application/json` mimetype.  The arguments
@@ -332,15 +1450,554 @@ def jsonify(*args, **kwargs):
     information about this, have a look at :ref:`json-security`.
 
     .. versionadded:: 0.2
+
+    .. versionchanged:: 0.5
+       The JSON is serialized by the :attr:`~Flask.json_backend` and only
+       indented if :attr:`~Flask.jsonify_indent` is set.
     """
     if __debug__:
         _assert_have_json()
-    return current_app.response_class(json.dumps(dict(*args, **kwargs),
-        indent=None if request.is_xhr else 2), mimetype='application/json')
+    app = current_app
+    return app.response_class(app.json_backend.dumps(dict(*args, **kwargs),
+        indent=app.jsonify_indent), mimetype='application/json')
+
+
+def stream_jsonify(key, iterable, **kwargs):
+    """Like :func:`jsonify` but for large results.  The items of the
+    iterable are serialized one after another while the response is sent
+    and end up as array under `key` in the JSON object, next to the keyword
+    arguments::
+
+        @app.route('/export')
+        def export():
+            rows = query_db('select * from message')
+            return stream_jsonify('messages', rows, count=len(rows))
+
+    This will send a JSON response like this to the browser::
+
+        {"count":2,"messages":[{...},{...}]}
+
+    The items are serialized by the :attr:`~Flask.json_backend` without
+    indentation.  Like with :func:`stream_template` the request context
+    stays available until the response is consumed, but the after request
+    functions were already called at that point.
+
+    .. versionadded:: 0.5
+
+    :param key: the key of the array in the JSON object.
+    :param iterable: an iterable or generator with the items of the array.
+    :param kwargs: the other values of the JSON object.  They must not
+                   contain `key`.
+    """
+    if __debug__:
+        _assert_have_json()
+    if key in kwargs:
+        raise TypeError('%r is used for the streamed array and cannot be '
+                        'passed as keyword argument' % key)
+    dumps = current_app.json_backend.dumps
+    def generate():
+        members = ['%s:%s' % (dumps(name), dumps(value))
+                   for name, value in kwargs.iteritems()]
+        members.append('%s:[' % dumps(key))
+        yield '{' + ','.join(members)
+        buffer = []
+        separator = ''
+        for item in iterable:
+            buffer.append(dumps(item))
+            if len(buffer) >= 100:
+                yield separator + ','.join(buffer)
+                separator = ','
+                del buffer[:]
+        if buffer:
+            yield separator + ','.join(buffer)
+        yield ']}'
+    gen = _stream_with_request_context(_request_ctx_stack.top, generate())
+    return current_app.response_class(gen, mimetype='application/json')
+
+
+class _NotModified(HTTPException):
+    """Raised by :func:`abort_if_not_modified` to answer a request with
+    ``304 Not Modified``.
+    """
+    code = 304
+
+    def get_response(self, environ):
+        rv = current_app.response_class(status=304)
+        version = _request_ctx_stack.top.response_version
+        if version is not None:
+            _apply_response_version(rv, version)
+        return rv
+
+
+def _is_modified(environ, etag=None, last_modified=None):
+    """Like :func:`~werkzeug.is_resource_modified` but compares the etag
+    with the weak comparison `If-None-Match` calls for, so weak etags such
+    as the ones of compressed responses match as well.
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if etag is not None and if_none_match:
+        return not parse_etags(if_none_match) \
+            .contains_weak(unquote_etag(etag)[0])
+    if last_modified is not None:
+        if isinstance(last_modified, basestring):
+            last_modified = parse_date(last_modified)
+        modified_since = parse_date(environ.get('HTTP_IF_MODIFIED_SINCE'))
+        if modified_since is not None and last_modified is not None and \
+           last_modified <= modified_since:
+            return False
+    return True
+
+
+def _apply_response_version(response, version):
+    etag, weak, last_modified = version
+    if etag is not None and 'etag' not in response.headers:
+        # compressed bodies differ from the resource byte for byte
+        response.set_etag(etag, weak or 'content-encoding' in
+                          response.headers)
+    if last_modified is not None and 'last-modified' not in response.headers:
+        response.headers['Last-Modified'] = http_date(last_modified)
+
+
+def abort_if_not_modified(etag=None, last_modified=None, weak=False):
+    """Answers the request with ``304 Not Modified`` if the client already
+    has the current version of the resource.  Views can call this with a
+    version token before they do the expensive work of rendering::
+
+        @app.route('/entry/<int:id>')
+        def show_entry(id):
+            entry = Entry.query.get(id)
+            abort_if_not_modified(etag=str(entry.revision),
+                                  last_modified=entry.pub_date)
+            return render_template('entry.html', entry=entry)
+
+    If the client does not have the current version, the function returns
+    and the `ETag` and `Last-Modified` headers are added to the response of
+    the view.  This only has an effect for ``GET`` and ``HEAD`` requests.
+
+    .. versionadded:: 0.5
+
+    :param etag: the version token of the resource, unquoted.
+    :param last_modified: a :class:`~datetime.datetime` or timestamp of the
+                          last modification of the resource.
+    :param weak: if the etag is a weak etag.
+    """
+    ctx = _request_ctx_stack.top
+    if ctx.request.method not in ('GET', 'HEAD'):
+        return
+    ctx.response_version = (etag, weak, last_modified)
+    if etag is not None:
+        etag = quote_etag(etag, weak)
+    if isinstance(last_modified, (int, long, float)):
+        last_modified = datetime.utcfromtimestamp(last_modified)
+    if last_modified is not None:
+        # HTTP dates have no fractions of a second
+        last_modified = last_modified.replace(microsecond=0)
+    if not _is_modified(ctx.request.environ, etag, last_modified):
+        raise _NotModified()
+
+
+def _parse_byte_range(value, length):
+    """Parses the value of a `Range` header for a resource with `length`
+    bytes.  Returns a ``(start, stop)`` tuple for a single satisfiable
+    range, `False` if the range can not be satisfied and `None` if the
+    header should be ignored.  Requests for multiple ranges are ignored and
+    answered with the whole resource.
+    """
+    if not value or '=' not in value:
+        return None
+    unit, ranges = value.split('=', 1)
+    if unit.strip().lower() != 'bytes' or ',' in ranges or \
+       '-' not in ranges:
+        return None
+    start, stop = ranges.split('-', 1)
+    try:
+        if not start.strip():
+            suffix = int(stop)
+            if suffix <= 0:
+                return False
+            return max(length - suffix, 0), length
+        start = int(start)
+        stop = stop.strip() and int(stop) + 1 or length
+    except ValueError:
+        return None
+    if start >= length or stop <= start:
+        return False
+    return start, min(stop, length)
+
+
+class _FileRangeWrapper(object):
+    """Like the :class:`~werkzeug.wsgi.FileWrapper` but only yields the
+    `length` bytes starting at `start` of the file.
+    """
+
+    def __init__(self, file, start, length, buffer_size=8192):
+        self.file = file
+        self.remaining = length
+        self.buffer_size = buffer_size
+        file.seek(start)
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.remaining > 0:
+            data = self.file.read(min(self.buffer_size, self.remaining))
+            if data:
+                self.remaining -= len(data)
+                return data
+        raise StopIteration()
+
+
+# matches filenames with a fingerprint added by the static file handler
+_fingerprinted_re = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)?$')
+
+# precompressed siblings of static files in order of preference
+_static_encodings = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _hash_static_file(path):
+    """Returns the fingerprint of a static file."""
+    h = md5()
+    f = open(path, 'rb')
+    try:
+        for chunk in iter(lambda: f.read(65536), ''):
+            h.update(chunk)
+    finally:
+        f.close()
+    return h.hexdigest()[:12]
+
+
+def _add_fingerprint(filename, fingerprint):
+    dirname, basename = posixpath.split(filename)
+    base, ext = posixpath.splitext(basename)
+    if not base:
+        base, ext = ext, ''
+    return posixpath.join(dirname, '%s.%s%s' % (base, fingerprint, ext))
+
+
+class _StaticFile(object):
+    """The information about a static file that is remembered by the
+    :class:`StaticFileHandler` between requests.
+    """
+    __slots__ = ('path', 'size', 'mtime', 'mimetype', 'last_modified',
+                 'etag', 'variants', 'fingerprint')
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        mimetype, encoding = mimetypes.guess_type(path)
+        if encoding is not None:
+            mimetype = 'application/octet-stream'
+        self.mimetype = mimetype or 'text/plain'
+        self.last_modified = http_date(stat.st_mtime)
+        if isinstance(path, unicode):
+            hashed_path = path.encode('utf-8')
+        else:
+            hashed_path = path
+        self.etag = 'static-%d-%d-%s' % (stat.st_mtime, stat.st_size,
+                                         zlib.adler32(hashed_path) &
+                                         0xffffffff)
+        self.variants = []
+        for encoding, extension in _static_encodings:
+            if os.path.isfile(path + extension):
+                variant_stat = os.stat(path + extension)
+                self.variants.append((encoding, path + extension,
+                                      variant_stat.st_size,
+                                      variant_stat.st_mtime))
+        self.fingerprint = None
+
+    def is_fresh(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return stat.st_mtime == self.mtime and stat.st_size == self.size
+
+
+class StaticFileHandler(object):
+    """Serves the static files of an application directly from the file
+    system.  This takes the place of the
+    :class:`~werkzeug.SharedDataMiddleware` in front of :meth:`Flask.wsgi_app`.
+    Requests for files that do not exist are passed on to the application.
+
+    Files are resolved and stat'ed once and then remembered, in debug mode
+    they are checked for modifications on every request.  Otherwise a
+    modified or removed file is noticed when it is sent the next time, but
+    conditional requests may still be answered from what is remembered
+    until then.  The contents are
+    sent with the WSGI server's file_wrapper and responses carry `ETag`,
+    `Last-Modified` and caching headers.  If a client accepts it and a
+    ``.br`` or ``.gz`` file exists next to the requested file, the
+    precompressed file is sent instead.
+
+    If :attr:`Flask.static_fingerprints` is enabled, :func:`url_for` adds
+    a hash of the contents of a file to the filenames it generates for the
+    ``static`` endpoint.  Such URLs change whenever the file changes and are
+    cached by clients for a year.
+
+    Without a manifest the hash of a file is computed when the first URL to
+    it is generated.  :meth:`build_manifest` computes the hashes of all
+    files up front and writes them to the file configured as
+    :attr:`Flask.static_manifest`, from where they are loaded by every
+    worker instead of hashing the files again.  If a manifest is used, only
+    the files listed there get fingerprinted URLs.
+
+    .. versionadded:: 0.5
+
+    :param app: the application the handler belongs to.
+    :param wsgi_app: the WSGI application requests that are not for static
+                     files are passed on to.
+    :param url_path: the URL path static files are served from.
+    :param directory: the folder with the static files.
+    """
+
+    #: The number of seconds responses for fingerprinted URLs are cached.
+    fingerprint_cache_timeout = 365 * 24 * 60 * 60
+
+    def __init__(self, app, wsgi_app, url_path, directory):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.url_prefix = url_path.rstrip('/') + '/'
+        self.directory = directory
+        self._files = {}
+        self._manifest = None
+
+    def clear(self):
+        """Forgets everything that is known about the static files,
+        including the loaded manifest.
+        """
+        self._files.clear()
+        self._manifest = None
+
+    def _forget(self, file):
+        for filename, value in self._files.items():
+            if value is file:
+                del self._files[filename]
+
+    def _set_manifest(self, fingerprints):
+        # maps filenames to fingerprinted filenames and back
+        rv = {}
+        for filename, fingerprint in fingerprints.iteritems():
+            fingerprinted = _add_fingerprint(filename, fingerprint)
+            rv[filename] = fingerprinted
+            rv[fingerprinted] = filename
+        self._manifest = (fingerprints, rv)
+
+    def get_manifest(self):
+        """Returns the manifest as dictionary from filenames to
+        fingerprints or `None` if no manifest is used.  The manifest is
+        loaded from the :attr:`Flask.static_manifest` file on first use.
+        If there is no such file that is remembered as well.  In debug mode
+        a missing manifest is looked for again on every call, otherwise
+        call :meth:`clear` to pick up a manifest that was created later.
+        """
+        manifest = self._manifest
+        if manifest is None or (manifest is False and self.app.debug):
+            filename = self.app.static_manifest
+            if filename is None or not os.path.isfile(filename):
+                self._manifest = False
+                return None
+            f = open(filename, 'rb')
+            try:
+                self._set_manifest(pickle.load(f))
+            finally:
+                f.close()
+        elif manifest is False:
+            return None
+        return self._manifest[0]
+
+    def build_manifest(self):
+        """Computes the fingerprints of all static files and writes them
+        to the :attr:`Flask.static_manifest` file if one is configured.
+        This is meant to be called when the application is deployed or
+        started.  Precompressed siblings of files are not listed.  Returns
+        the manifest.
+        """
+        fingerprints = {}
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            relpath = dirpath[len(self.directory):].strip(os.path.sep)
+            prefix = relpath and '/'.join(relpath.split(os.path.sep)) + '/'
+            names = set(filenames)
+            for name in filenames:
+                root, ext = os.path.splitext(name)
+                if ext in ('.gz', '.br') and root in names:
+                    continue
+                fingerprints[prefix + name] = _hash_static_file(
+                    os.path.join(dirpath, name))
+        filename = self.app.static_manifest
+        if filename is not None:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(
+                os.path.abspath(filename)))
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(fingerprints, f, 2)
+            finally:
+                f.close()
+            if os.name == 'nt' and os.path.isfile(filename):
+                os.remove(filename)
+            os.rename(tmp, filename)
+        self._set_manifest(fingerprints)
+        return fingerprints
+
+    def get_file(self, filename):
+        """Returns what is known about a static file given by its filename
+        relative to the static folder or `None` if no such file exists.
+        """
+        rv = self._files.get(filename)
+        if rv is not None and (not self.app.debug or rv.is_fresh()):
+            return rv
+        if '\\' in filename or posixpath.isabs(filename) or \
+           posixpath.normpath(filename) != filename or \
+           filename.split('/', 1)[0] == '..':
+            return None
+        path = os.path.join(self.directory, *filename.split('/'))
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            # TypeError is raised for filenames with null bytes
+            return None
+        if not os.path.isfile(path):
+            return None
+        rv = self._files[filename] = _StaticFile(path, stat)
+        return rv
+
+    def get_fingerprint(self, filename):
+        """Returns the hash of the contents of a static file that is used
+        in fingerprinted filenames or `None` if the file does not exist.
+        """
+        manifest = self.get_manifest()
+        if manifest is not None:
+            return manifest.get(filename)
+        file = self.get_file(filename)
+        if file is None:
+            return None
+        if file.fingerprint is None:
+            file.fingerprint = _hash_static_file(file.path)
+        return file.fingerprint
+
+    def get_fingerprinted_filename(self, filename):
+        """Adds the fingerprint of a static file to its filename.  If the
+        file does not exist the filename is returned unchanged.
+        """
+        if self.get_manifest() is not None:
+            return self._manifest[1].get(filename, filename)
+        fingerprint = self.get_fingerprint(filename)
+        if fingerprint is None:
+            return filename
+        return _add_fingerprint(filename, fingerprint)
+
+    def _lookup(self, filename):
+        file = self.get_file(filename)
+        if file is not None:
+            return file, False
+        if self.get_manifest() is not None:
+            original = self._manifest[1].get(filename)
+            if original is not None:
+                return self.get_file(original), True
+        match = _fingerprinted_re.match(filename)
+        if match is not None:
+            original = match.group(1) + (match.group(3) or '')
+            file = self.get_file(original)
+            if file is not None:
+                return file, self.get_fingerprint(original) == match.group(2)
+        return None, False
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or ''
+        method = environ['REQUEST_METHOD']
+        if not path.startswith(self.url_prefix) or \
+           method not in ('GET', 'HEAD'):
+            return self.wsgi_app(environ, start_response)
+        return self._serve(environ, start_response,
+                           path[len(self.url_prefix):], True)
+
+    def _serve(self, environ, start_response, name, retry):
+        file, fingerprinted = self._lookup(name)
+        if file is None:
+            return self.wsgi_app(environ, start_response)
+
+        method = environ['REQUEST_METHOD']
+        filename, size, mtime, etag = file.path, file.size, file.mtime, \
+            file.etag
+        headers = [('Content-Type', file.mimetype)]
+        if file.variants:
+            headers.append(('Vary', 'Accept-Encoding'))
+            accept = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+            for encoding, variant_filename, variant_size, variant_mtime \
+                    in file.variants:
+                if accept[encoding]:
+                    headers.append(('Content-Encoding', encoding))
+                    filename, size, mtime = variant_filename, \
+                        variant_size, variant_mtime
+                    etag += '-' + encoding
+                    break
+        if fingerprinted:
+            timeout = self.fingerprint_cache_timeout
+        else:
+            timeout = self.app.static_cache_timeout
+        etag = quote_etag(etag)
+        headers.extend((
+            ('ETag', etag),
+            ('Last-Modified', file.last_modified),
+            ('Cache-Control', 'public, max-age=%d' % timeout),
+            ('Expires', http_date(time() + timeout))
+        ))
+
+        if not is_resource_modified(environ, etag, None, file.last_modified):
+            start_response('304 NOT MODIFIED', headers)
+            return []
+        headers.append(('Content-Length', str(size)))
+        if method == 'HEAD':
+            start_response('200 OK', headers)
+            return []
+
+        # the file may have been changed or removed since it was stat'ed.
+        # In that case look it up again so that the headers match the body
+        # that is sent, or pass the request on if it is gone.
+        try:
+            f = open(filename, 'rb')
+        except (IOError, OSError):
+            f = None
+        else:
+            stat = os.fstat(f.fileno())
+            if stat.st_size != size or stat.st_mtime != mtime:
+                f.close()
+                f = None
+        if f is None:
+            self._forget(file)
+            if retry:
+                return self._serve(environ, start_response, name, False)
+            return self.wsgi_app(environ, start_response)
+        start_response('200 OK', headers)
+        return wrap_file(environ, f)
+
+
+def _compress_iter(iterable, charset, level, wbits):
+    """Compresses the chunks of a streamed body.  Every chunk is flushed
+    so that the client can use it right away.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    try:
+        for chunk in iterable:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode(charset)
+            data = compressor.compress(chunk) + \
+                compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
 
 
 def send_file(filename_or_fp, mimetype=None, as_attachment=False,
-              attachment_filename=None):
+              attachment_filename=None, add_etags=True, conditional=True):
     """Sends the contents of a file to the client.  This will use the
     most efficient method available and configured.  By default it will
     try to use the WSGI server's file_wrapper support.  Alternatively
@@ -359,8 +2016,18 @@ def send_file(filename_or_fp, mimetype=None, as_attachment=False,
         if '..' in filename or filename.startswith('/'):
             abort(404)
 
+    If the size and modification time of the file can be determined, the
+    `Content-Length`, `Last-Modified` and `ETag` headers are set and,
+    unless `conditional` is disabled, conditional requests are answered
+    with ``304 Not Modified`` and requests for a single byte range with
+    ``206 Partial Content``.  Ranges that extend to the end of the file are
+    sent with the WSGI server's file_wrapper as well.
+
     .. versionadded:: 0.2
 
+    .. versionchanged:: 0.5
+       The `add_etags` and `conditional` parameters were added.
+
     :param filename_or_fp: the filename of the file to send.  This is
                            relative to the :attr:`~Flask.root_path` if a
                            relative path is specified.
@@ -373,6 +2040,9 @@ def send_file(filename_or_fp, mimetype=None, as_attachment=False,
                           a ``Content-Disposition: attachment`` header.
     :param attachment_filename: the filename for the attachment if it
                                 differs from the file's filename.
+    :param add_etags: set to `False` to disable attaching of etags.
+    :param conditional: set to `False` to disable conditional and range
+                        responses.
     """
     if isinstance(filename_or_fp, basestring):
         filename = filename_or_fp
@@ -397,18 +2067,76 @@ def send_file(filename_or_fp, mimetype=None, as_attachment=False,
         headers.add('Content-Disposition', 'attachment',
                     filename=attachment_filename)
 
+    stat = None
     if current_app.use_x_sendfile and filename:
         if file is not None:
             file.close()
         headers['X-Sendfile'] = filename
-        data = None
+        stat = os.stat(filename)
+        file = None
     else:
         if file is None:
             file = open(filename, 'rb')
-        data = wrap_file(request.environ, file)
+        # in-memory files and pipes cannot be stat'ed and the size of the
+        # file is only the length of the body if it was not read yet.
+        try:
+            if file.tell() == 0:
+                stat = os.fstat(file.fileno())
+        except (AttributeError, UnsupportedOperation, IOError, OSError):
+            pass
 
-    return Response(data, mimetype=mimetype, headers=headers,
-                    direct_passthrough=True)
+    if stat is None:
+        return Response(wrap_file(request.environ, file), mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+
+    size = stat.st_size
+    headers['Content-Length'] = str(size)
+    headers['Last-Modified'] = http_date(stat.st_mtime)
+    if add_etags and filename is not None:
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+        headers['ETag'] = quote_etag('flask-%s-%s-%s' % (
+            int(stat.st_mtime), size, zlib.adler32(filename) & 0xffffffff))
+
+    status = 200
+    data = None
+    environ = request.environ
+    if conditional and environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+        if not is_resource_modified(environ, headers.get('ETag'), None,
+                                    headers['Last-Modified']):
+            status = 304
+        elif file is not None:
+            # the web server takes care of ranges if X-Sendfile is used
+            byte_range = _parse_byte_range(environ.get('HTTP_RANGE'), size)
+            if_range = environ.get('HTTP_IF_RANGE')
+            if byte_range is not None and if_range and if_range not in \
+               (headers.get('ETag'), headers['Last-Modified']):
+                byte_range = None
+            if byte_range is False:
+                status = 416
+                headers['Content-Range'] = 'bytes */%d' % size
+                headers['Content-Length'] = '0'
+            elif byte_range is not None:
+                start, stop = byte_range
+                status = 206
+                headers['Content-Range'] = 'bytes %d-%d/%d' % \
+                    (start, stop - 1, size)
+                headers['Content-Length'] = str(stop - start)
+                if stop == size:
+                    file.seek(start)
+                    data = wrap_file(environ, file)
+                else:
+                    data = _FileRangeWrapper(file, start, stop - start)
+        headers['Accept-Ranges'] = 'bytes'
+
+    if status in (304, 416):
+        if file is not None:
+            file.close()
+    elif data is None and file is not None:
+        data = wrap_file(environ, file)
+
+    return Response(data, status=status, mimetype=mimetype,
+                    headers=headers, direct_passthrough=True)
 
 
 def render_template(template_name, **context):
@@ -436,14 +2164,157 @@ def render_template_string(source, **context):
     return current_app.jinja_env.from_string(source).render(context)
 
 
+def _stream_with_request_context(ctx, gen):
+    """Iterates over `gen` with the request context `ctx` bound, even if
+    the iteration happens after the WSGI application returned.
+    """
+    while 1:
+        pushed = _request_ctx_stack.top is not ctx
+        if pushed:
+            ctx.push()
+        try:
+            item = gen.next()
+        except StopIteration:
+            return
+        finally:
+            if pushed:
+                ctx.pop()
+        yield item
+
+
+def _stream(template, context):
+    app = current_app
+    app.update_template_context(context)
+    stream = template.stream(context)
+    if app.template_stream_buffer_size:
+        stream.enable_buffering(app.template_stream_buffer_size)
+    gen = _stream_with_request_context(_request_ctx_stack.top, stream)
+    return app.response_class(gen, mimetype='text/html')
+
+
+def stream_template(template_name, **context):
+    """Like :func:`render_template` but returns a response that renders
+    the template while it is sent to the client instead of building the
+    whole page in memory first.  The chunks are collected into groups of
+    :attr:`~Flask.template_stream_buffer_size` before they are sent.
+
+    The request context stays available to the template until the response
+    is consumed, but the session was already saved when the body is
+    generated so changes to it from within the template are lost.
+
+    .. versionadded:: 0.5
+
+    :param template_name: the name of the template to be rendered
+    :param context: the variables that should be available in the
+                    context of the template.
+    """
+    return _stream(current_app.jinja_env.get_template(template_name),
+                   context)
+
+
+def stream_template_string(source, **context):
+    """Like :func:`render_template_string` but streams the template like
+    :func:`stream_template` does.
+
+    .. versionadded:: 0.5
+
+    :param source: the sourcecode of the template to be rendered
+    :param context: the variables that should be available in the
+                    context of the template.
+    """
+    return _stream(current_app.jinja_env.from_string(source), context)
+
+
+def request_cacheable(f):
+    """Marks a template context processor as cacheable for the duration of
+    a request.  Such a processor is only called for the first template
+    rendered in a request, later templates reuse the returned dictionary::
+
+        @app.context_processor
+        @request_cacheable
+        def inject_user():
+            return dict(user=load_user(session.get('user_id')))
+
+    Only use this for processors whose return value does not change while
+    the request is handled.
+
+    .. versionadded:: 0.5
+    """
+    f.request_cacheable = True
+    return f
+
+
+def cache_response(timeout=None, query_args=True, headers=(),
+                   session=False, key_func=None):
+    """Caches the responses of a view in the :attr:`~Flask.response_cache`
+    so that later requests for the same resource are answered without
+    calling the view at all::
+
+        @app.route('/public')
+        @cache_response(timeout=60)
+        def public_timeline():
+            ...
+
+    Responses are cached per URL.  The other parts of the key are
+    configured with the arguments.  Only ``GET`` and ``HEAD`` requests are
+    answered from the cache, and before and after request functions are
+    still called for cached responses.
+
+    Unless `session` is enabled, responses of views that used the session
+    (for example to show flashed messages or the logged in user) are not
+    cached, as they are usually different for every user.
+
+    .. versionadded:: 0.5
+
+    :param timeout: the number of seconds responses are cached.  Defaults
+                    to :attr:`~Flask.response_cache_timeout`.
+    :param query_args: if `True` the query arguments are part of the key.
+    :param headers: the names of request headers that are part of the key.
+    :param session: if `True` the session cookie is part of the key, so
+                    every session gets its own cached responses.  Responses
+                    of views that modify the session are never cached.
+    :param key_func: a function that is called without arguments and
+                     returns a hashable value that is added to the key.
+    """
+    def decorator(f):
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+            app = current_app
+            key = [request.base_url]
+            if query_args:
+                key.append(tuple(sorted(request.args.items(multi=True))))
+            for header in headers:
+                key.append(request.headers.get(header))
+            if session:
+                key.append(request.cookies.get(app.session_cookie_name))
+            if key_func is not None:
+                key.append(key_func())
+            key = tuple(key)
+            cache = app.response_cache
+            rv = cache.get(key, request.headers)
+            if rv is None:
+                rv = app.make_response(f(*args, **kwargs))
+                used_session = _request_ctx_stack.top._session
+                if used_session is None or \
+                   isinstance(used_session, _NullSession) or \
+                   (session and not getattr(used_session, 'modified', True)):
+                    cache.set(key, request.headers, rv, timeout)
+            return rv
+        return update_wrapper(decorated_function, f)
+    return decorator
+
+
+@request_cacheable
 def _default_template_ctx_processor():
     """Default template context processor.  Injects `request`,
-    `session` and `g`.
+    `session` and `g`.  The session is injected as proxy so that it is
+    only loaded if the template actually uses it.
     """
     reqctx = _request_ctx_stack.top
     return dict(
         request=reqctx.request,
-        session=reqctx.session,
+        session=session,
         g=reqctx.g
     )
 
@@ -825,6 +2696,27 @@ class Flask(_PackageBoundObject):
     #: :class:`~flask.Response` for more information.
     response_class = Response
 
+    #: The session interface that is used to open and save sessions.  See
+    #: :class:`~flask.SessionInterface` for more information.
+    #:
+    #: .. versionadded:: 0.5
+    session_interface = SecureCookieSessionInterface()
+
+    #: The serializer used for the values of cookie based sessions.  It has
+    #: to provide `dumps` and `loads` functions like :mod:`pickle`, which is
+    #: used if this is `None`.  See :class:`~flask.TaggedJSONSerializer` and
+    #: :class:`~flask.CompressedSerializer` for smaller and faster
+    #: alternatives.  Changing the serializer invalidates existing sessions.
+    #:
+    #: .. versionadded:: 0.5
+    session_serializer = None
+
+    #: The class that is used for the :attr:`json_backend` of every
+    #: application.  See :class:`~flask.JSONBackend` for more information.
+    #:
+    #: .. versionadded:: 0.5
+    json_backend_class = JSONBackend
+
     #: Path for the static files.  If you don't want to use static files
     #: you can set this value to `None` in which case no URL rule is added
     #: and the development server will no longer serve any static files.
@@ -871,6 +2763,18 @@ class Flask(_PackageBoundObject):
     #: ``timedelta(days=31)``
     permanent_session_lifetime = ConfigAttribute('PERMANENT_SESSION_LIFETIME')
 
+    #: A :class:`~datetime.timedelta`.  Permanent sessions that were not
+    #: modified are only sent to the client again if their cookie expires
+    #: within this window.  The default is one day.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `PERMANENT_SESSION_REFRESH_WINDOW` configuration key.  Defaults to
+    #: ``timedelta(days=1)``
+    permanent_session_refresh_window = \
+        ConfigAttribute('PERMANENT_SESSION_REFRESH_WINDOW')
+
     #: Enable this if you want to use the X-Sendfile feature.  Keep in
     #: mind that the server has to support this.  This only affects files
     #: sent with the :func:`send_file` method.
@@ -887,6 +2791,180 @@ class Flask(_PackageBoundObject):
     #: .. versionadded:: 0.4
     logger_name = ConfigAttribute('LOGGER_NAME')
 
+    #: Enable this to dispatch requests through the table built by
+    #: :meth:`compile_dispatch`.  Each request then does a single lookup
+    #: for the endpoint instead of assembling the hook chains again.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `COMPILED_DISPATCH` configuration key.  Defaults to `False`.
+    compiled_dispatch = ConfigAttribute('COMPILED_DISPATCH')
+
+    #: The number of URL adapters that are kept around for reuse.  The
+    #: adapters are bound to the server name, script name and URL scheme
+    #: of the request and shared between requests with the same values.
+    #: Set this to ``0`` to bind a new adapter for every request.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `URL_ADAPTER_CACHE_SIZE` configuration key.  Defaults to ``0``.
+    url_adapter_cache_size = ConfigAttribute('URL_ADAPTER_CACHE_SIZE')
+
+    #: Enable this to match URLs with the help of an index of the literal
+    #: path segments of the rules.  Instead of trying every rule of the
+    #: :attr:`url_map` in order, only the rules behind the longest matching
+    #: prefix are tried.  This pays off for applications with many rules.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `URL_PREFIX_INDEX` configuration key.  Defaults to `False`.
+    url_prefix_index = ConfigAttribute('URL_PREFIX_INDEX')
+
+    #: The number of URLs built by :func:`url_for` that are remembered.
+    #: The cache is keyed by the endpoint, the values and the server name,
+    #: script name, URL scheme and method of the URL adapter.  URLs for the
+    #: ``static`` endpoint are shared by all methods and, unless external,
+    #: all hosts.  Set this to ``0`` to disable the cache.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `URL_BUILD_CACHE_SIZE` configuration key.  Defaults to ``0``.
+    url_build_cache_size = ConfigAttribute('URL_BUILD_CACHE_SIZE')
+
+    #: The number of template chunks :func:`stream_template` collects
+    #: before it hands them to the WSGI server.  Small values lower the
+    #: time to the first byte, large values lower the per chunk overhead of
+    #: the server.  Set this to ``0`` to send every chunk on its own.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `TEMPLATE_STREAM_BUFFER_SIZE` configuration key.  Defaults to ``5``.
+    template_stream_buffer_size = \
+        ConfigAttribute('TEMPLATE_STREAM_BUFFER_SIZE')
+
+    #: The number of fragments the :attr:`fragment_cache` holds.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `FRAGMENT_CACHE_SIZE` configuration key.  Defaults to ``1000``.
+    fragment_cache_size = ConfigAttribute('FRAGMENT_CACHE_SIZE')
+
+    #: The number of seconds fragments are kept in the
+    #: :attr:`fragment_cache` if no timeout is given.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `FRAGMENT_CACHE_TIMEOUT` configuration key.  Defaults to ``300``.
+    fragment_cache_timeout = ConfigAttribute('FRAGMENT_CACHE_TIMEOUT')
+
+    #: The maximum number of bytes the :attr:`response_cache` holds.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `RESPONSE_CACHE_SIZE` configuration key.  Defaults to ten megabytes.
+    response_cache_size = ConfigAttribute('RESPONSE_CACHE_SIZE')
+
+    #: The number of seconds responses are kept in the
+    #: :attr:`response_cache` if the view does not give a timeout.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `RESPONSE_CACHE_TIMEOUT` configuration key.  Defaults to ``300``.
+    response_cache_timeout = ConfigAttribute('RESPONSE_CACHE_TIMEOUT')
+
+    #: Enable this to add an `ETag` computed from the body to successful
+    #: responses to ``GET`` and ``HEAD`` requests and to answer requests
+    #: from clients that already have that body with ``304 Not Modified``.
+    #: Streamed responses are left alone.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `CONDITIONAL_RESPONSES` configuration key.  Defaults to `False`.
+    conditional_responses = ConfigAttribute('CONDITIONAL_RESPONSES')
+
+    #: The number of seconds clients may cache static files.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `STATIC_CACHE_TIMEOUT` configuration key.  Defaults to twelve hours.
+    static_cache_timeout = ConfigAttribute('STATIC_CACHE_TIMEOUT')
+
+    #: Enable this to let :func:`url_for` add a hash of the contents to
+    #: the filenames of static files.  See :class:`StaticFileHandler`.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `STATIC_FINGERPRINTS` configuration key.  Defaults to `False`.
+    static_fingerprints = ConfigAttribute('STATIC_FINGERPRINTS')
+
+    #: The filename of the manifest with the fingerprints of the static
+    #: files that is written by :meth:`StaticFileHandler.build_manifest`.
+    #: If the file exists, fingerprinted URLs are generated from it.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `STATIC_MANIFEST` configuration key.  Defaults to `None`.
+    static_manifest = ConfigAttribute('STATIC_MANIFEST')
+
+    #: The indentation of the JSON sent by :func:`jsonify`.  If this is
+    #: `None` the JSON is as compact as possible.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `JSONIFY_INDENT` configuration key.  Defaults to `None`.
+    jsonify_indent = ConfigAttribute('JSONIFY_INDENT')
+
+    #: Enable this to compress responses with gzip or deflate for clients
+    #: that accept it.  See :meth:`compress_response`.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `COMPRESS_RESPONSES` configuration key.  Defaults to `False`.
+    compress_responses = ConfigAttribute('COMPRESS_RESPONSES')
+
+    #: The zlib compression level from ``1`` (fastest) to ``9`` (smallest)
+    #: used to compress responses.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `COMPRESS_LEVEL` configuration key.  Defaults to ``6``.
+    compress_level = ConfigAttribute('COMPRESS_LEVEL')
+
+    #: The number of bytes a body needs at least to be compressed.  Smaller
+    #: bodies do not get smaller by compressing them.  Streamed bodies are
+    #: always compressed.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `COMPRESS_MIN_SIZE` configuration key.  Defaults to ``500``.
+    compress_min_size = ConfigAttribute('COMPRESS_MIN_SIZE')
+
+    #: The mimetypes of the responses that are compressed.
+    #:
+    #: .. versionadded:: 0.5
+    #:
+    #: This attribute can also be configured from the config with the
+    #: `COMPRESS_MIMETYPES` configuration key.  Defaults to HTML, CSS,
+    #: plain text, XML, JavaScript and JSON.
+    compress_mimetypes = ConfigAttribute('COMPRESS_MIMETYPES')
+
     #: The logging format used for the debug logger.  This is only used when
     #: the application is in debug mode, otherwise the attached logging
     #: handler does the formatting.
@@ -912,8 +2990,31 @@ class Flask(_PackageBoundObject):
         'SECRET_KEY':                           None,
         'SESSION_COOKIE_NAME':                  'session',
         'PERMANENT_SESSION_LIFETIME':           timedelta(days=31),
+        'PERMANENT_SESSION_REFRESH_WINDOW':     timedelta(days=1),
         'USE_X_SENDFILE':                       False,
-        'LOGGER_NAME':                          None
+        'LOGGER_NAME':                          None,
+        'COMPILED_DISPATCH':                    False,
+        'URL_ADAPTER_CACHE_SIZE':               0,
+        'URL_PREFIX_INDEX':                     False,
+        'URL_BUILD_CACHE_SIZE':                 0,
+        'TEMPLATE_STREAM_BUFFER_SIZE':          5,
+        'FRAGMENT_CACHE_SIZE':                  1000,
+        'FRAGMENT_CACHE_TIMEOUT':               300,
+        'RESPONSE_CACHE_SIZE':                  10 * 1024 * 1024,
+        'RESPONSE_CACHE_TIMEOUT':               300,
+        'CONDITIONAL_RESPONSES':                False,
+        'STATIC_CACHE_TIMEOUT':                 12 * 60 * 60,
+        'STATIC_FINGERPRINTS':                  False,
+        'STATIC_MANIFEST':                      None,
+        'JSONIFY_INDENT':                       None,
+        'COMPRESS_RESPONSES':                   False,
+        'COMPRESS_LEVEL':                       6,
+        'COMPRESS_MIN_SIZE':                    500,
+        'COMPRESS_MIMETYPES':                   frozenset([
+            'text/html', 'text/css', 'text/plain', 'text/xml',
+            'application/json', 'application/javascript',
+            'application/xml'
+        ])
     })
 
     def __init__(self, import_name):
@@ -967,6 +3068,36 @@ class Flask(_PackageBoundObject):
             None: [_default_template_ctx_processor]
         }
 
+        #: The before request functions, after request functions and
+        #: template context processors merged per module name.  The
+        #: decorators that register such functions rebuild it, direct
+        #: modifications of the dictionaries above are picked up by
+        #: comparing them to :attr:`_hook_chains_state`.
+        self._hook_chains = None
+        self._hook_chains_state = None
+
+        #: The compiled dispatch table if :attr:`compiled_dispatch` is
+        #: enabled.  It is built on the first request and dropped whenever
+        #: a rule, hook or error handler is registered.
+        self._dispatch_table = None
+
+        #: The bound URL adapters if :attr:`url_adapter_cache_size` is set.
+        self._url_adapter_cache = None
+
+        #: The index of the URL rules if :attr:`url_prefix_index` is set.
+        self._url_prefix_index = None
+
+        #: The URLs remembered if :attr:`url_build_cache_size` is set.
+        self._url_build_cache = None
+
+        #: The number of :func:`url_for` calls that were answered from
+        #: and that missed the URL build cache.  Because the counters are
+        #: not locked they are only approximate in threaded environments.
+        #:
+        #: .. versionadded:: 0.5
+        self.url_build_cache_hits = 0
+        self.url_build_cache_misses = 0
+
         #: The :class:`~werkzeug.routing.Map` for this instance.  You can use
         #: this to change the routing converters after the class was created
         #: but before any routes are connected.  Example::
@@ -984,28 +3115,75 @@ class Flask(_PackageBoundObject):
         #:    app.url_map.converters['list'] = ListConverter
         self.url_map = Map()
 
+        #: The :class:`StaticFileHandler` that serves the static files or
+        #: `None` if the application has no static files or they are served
+        #: from a zipped package.
+        #:
+        #: .. versionadded:: 0.5
+        self.static_files = None
+
         if self.static_path is not None:
             self.add_url_rule(self.static_path + '/<filename>',
                               build_only=True, endpoint='static')
-            if pkg_resources is not None:
-                target = (self.import_name, 'static')
+            target = os.path.join(self.root_path, 'static')
+            if os.path.isdir(self.root_path) or pkg_resources is None:
+                self.static_files = StaticFileHandler(self, self.wsgi_app,
+                                                      self.static_path,
+                                                      target)
+                self.wsgi_app = self.static_files
             else:
-                target = os.path.join(self.root_path, 'static')
-            self.wsgi_app = SharedDataMiddleware(self.wsgi_app, {
-                self.static_path: target
-            })
+                # the package is not unpacked on the file system
+                self.wsgi_app = SharedDataMiddleware(self.wsgi_app, {
+                    self.static_path: (self.import_name, 'static')
+                })
+
+        #: The :class:`JSONBackend` used by :func:`jsonify` and
+        #: :attr:`Request.json`.  Every application has its own, so
+        #: encoders added to it do not affect other applications.  `None`
+        #: if no JSON module is available.
+        #:
+        #: .. versionadded:: 0.5
+        self.json_backend = None
+        if json_available:
+            self.json_backend = self.json_backend_class()
 
         #: The Jinja2 environment.  It is created from the
-        #: :attr:`jinja_options` and the loader that is returned
-        #: by the :meth:`create_jinja_loader` function.
+        #: :attr:`jinja_options`, the loader that is returned
+        #: by the :meth:`create_jinja_loader` function and the bytecode
+        #: cache returned by :meth:`create_jinja_bytecode_cache`.
         self.jinja_env = Environment(loader=self.create_jinja_loader(),
-                                     **self.jinja_options)
+            bytecode_cache=self.create_jinja_bytecode_cache(),
+            **self.jinja_options)
         self.jinja_env.globals.update(
             url_for=url_for,
-            get_flashed_messages=get_flashed_messages
+            get_flashed_messages=get_flashed_messages,
+            cache_fragment=_cache_fragment
         )
         self.jinja_env.filters['tojson'] = _tojson_filter
 
+    @cached_property
+    def fragment_cache(self):
+        """The :class:`FragmentCache` of this application.  It is created
+        on first access from the :attr:`fragment_cache_size` and
+        :attr:`fragment_cache_timeout` configuration values.
+
+        .. versionadded:: 0.5
+        """
+        return FragmentCache(self.fragment_cache_size,
+                             self.fragment_cache_timeout)
+
+    @cached_property
+    def response_cache(self):
+        """The :class:`ResponseCache` used by views decorated with
+        :func:`cache_response`.  It is created on first access from the
+        :attr:`response_cache_size` and :attr:`response_cache_timeout`
+        configuration values.
+
+        .. versionadded:: 0.5
+        """
+        return ResponseCache(self.response_cache_size,
+                             self.response_cache_timeout)
+
     @property
     def logger(self):
         """A :class:`logging.Logger` object for this application.  The
@@ -1051,19 +3229,61 @@ class Flask(_PackageBoundObject):
             return FileSystemLoader(os.path.join(self.root_path, 'templates'))
         return PackageLoader(self.import_name)
 
+    def create_jinja_bytecode_cache(self):
+        """Creates the bytecode cache for the Jinja environment.  By default
+        no bytecode cache is used and templates are compiled from source the
+        first time they are loaded by a process.  Override this method to
+        return a :class:`MemoryBytecodeCache` or a
+        :class:`~jinja2.FileSystemBytecodeCache`::
+
+            class MyFlask(Flask):
+                def create_jinja_bytecode_cache(self):
+                    return FileSystemBytecodeCache('/var/cache/myapp')
+
+        .. versionadded:: 0.5
+        """
+        return None
+
+    def precompile_templates(self, filter_func=None):
+        """Loads every template the Jinja loader knows about so that they
+        are compiled before the first request arrives.  Together with a
+        bytecode cache this can also be used at build time to write the
+        compiled templates to the cache.  Returns the names of the loaded
+        templates.
+
+        .. versionadded:: 0.5
+
+        :param filter_func: an optional function that is passed a template
+                            name and returns `True` if the template should
+                            be compiled.
+        """
+        rv = []
+        for name in self.jinja_env.list_templates():
+            if filter_func is None or filter_func(name):
+                self.jinja_env.get_template(name)
+                rv.append(name)
+        return rv
+
     def update_template_context(self, context):
         """Update the template context with some commonly used variables.
         This injects request, session and g into the template context.
 
+        Processors marked with :func:`request_cacheable` are only called
+        once per request.
+
         :param context: the context as a dictionary that is updated in place
                         to add extra variables.
         """
-        funcs = self.template_context_processors[None]
-        mod = _request_ctx_stack.top.request.module
-        if mod is not None and mod in self.template_context_processors:
-            funcs = chain(funcs, self.template_context_processors[mod])
-        for func in funcs:
-            context.update(func())
+        ctx = _request_ctx_stack.top
+        cache = ctx.template_context_cache
+        for func in self._current_hook_chains(ctx.request.module)[2]:
+            if getattr(func, 'request_cacheable', False):
+                rv = cache.get(func)
+                if rv is None:
+                    rv = cache[func] = func()
+            else:
+                rv = func()
+            context.update(rv)
 
     def run(self, host='127.0.0.1', port=5000, **options):
         """Runs the application on a local development server.  If the
@@ -1128,32 +3348,125 @@ class Flask(_PackageBoundObject):
     #   - 默认把全部session数据, 存入一个 cookie 中.
     #   - 需要设置 attr:`secret_key`
     #
+    def create_url_adapter(self, environ):
+        """Returns a :class:`~werkzeug.routing.MapAdapter` for the given
+        WSGI environment.  If :attr:`url_adapter_cache_size` is set, the
+        adapter is shared by all requests with the same server name, script
+        name, URL scheme and request method, so the path has to be passed to
+        :meth:`~werkzeug.routing.MapAdapter.match` explicitly.  The method
+        is part of the key because URL building prefers rules for it.
+
+        If :attr:`url_prefix_index` is enabled the adapter only tries the
+        rules that share the literal path prefix of the request.
+
+        .. versionadded:: 0.5
+
+        :param environ: a WSGI environment.
+        """
+        size = self.url_adapter_cache_size
+        if not size and not self.url_prefix_index:
+            return self.url_map.bind_to_environ(environ)
+        if 'HTTP_HOST' in environ:
+            server_name = environ['HTTP_HOST']
+        else:
+            server_name = environ['SERVER_NAME']
+            if (environ['wsgi.url_scheme'], environ['SERVER_PORT']) not \
+               in (('https', '443'), ('http', '80')):
+                server_name += ':' + environ['SERVER_PORT']
+        key = (server_name, environ.get('SCRIPT_NAME'),
+               environ['wsgi.url_scheme'], self.url_map.default_subdomain,
+               environ['REQUEST_METHOD'])
+        if not size:
+            return self._bind_url_map(key, environ.get('PATH_INFO'))
+        cache = self._url_adapter_cache
+        if cache is None or cache.capacity != size:
+            cache = self._url_adapter_cache = _LRUCache(size)
+        adapter = cache.get(key)
+        if adapter is None or adapter.map is not self.url_map:
+            adapter = self._bind_url_map(key)
+            cache[key] = adapter
+        return adapter
+
+    def _bind_url_map(self, key, path_info=None):
+        server_name, script_name, url_scheme, subdomain, method = key
+        if not self.url_prefix_index:
+            return self.url_map.bind(server_name, script_name, subdomain,
+                                     url_scheme, method, path_info)
+        index = self._url_prefix_index
+        if index is None or index.map is not self.url_map:
+            index = self._url_prefix_index = _PrefixIndex(self.url_map)
+        return _PrefixIndexAdapter(index, server_name, script_name or '/',
+                                   subdomain, url_scheme, path_info, method)
+
+    def _cached_url_build(self, adapter, endpoint, values, external):
+        try:
+            frozen = frozenset((k, type(v), v) for k, v in values.iteritems())
+        except TypeError:
+            # unhashable values (lists for query arguments for example)
+            # cannot be used as cache key.
+            return adapter.build(endpoint, values, force_external=external)
+        if endpoint == 'static':
+            binding = (adapter.script_name, adapter.subdomain, external and
+                       (adapter.url_scheme, adapter.server_name) or None)
+        else:
+            binding = (adapter.server_name, adapter.script_name,
+                       adapter.url_scheme, adapter.subdomain,
+                       adapter.default_method)
+        key = (endpoint, frozen, external, binding)
+        size = self.url_build_cache_size
+        cache = self._url_build_cache
+        if cache is None or cache.capacity != size:
+            cache = self._url_build_cache = _LRUCache(size)
+        rv = cache.get(key)
+        if rv is not None:
+            self.url_build_cache_hits += 1
+            return rv
+        self.url_build_cache_misses += 1
+        rv = cache[key] = adapter.build(endpoint, values,
+                                        force_external=external)
+        return rv
+
     def open_session(self, request):
-        """Creates or opens a new session.  Default implementation stores all
+        """Creates or opens a new session.  This is forwarded to the
+        :attr:`session_interface`.  The default implementation stores all
         session data in a signed cookie.  This requires that the
         :attr:`secret_key` is set.
 
         :param request: an instance of :attr:`request_class`.
         """
-        key = self.secret_key
-        if key is not None:
-            return Session.load_cookie(request, self.session_cookie_name,
-                                       secret_key=key)
+        return self.session_interface.open_session(self, request)
+
+    def should_save_session(self, session):
+        """Returns `True` if :meth:`save_session` has to be called for the
+        session.  This is the case if the session was modified or if it
+        expires within the :attr:`permanent_session_refresh_window`.
+        Permanent sessions with an unknown expiration date are saved as
+        well.
+
+        .. versionadded:: 0.5
+
+        :param session: the session of the current request.
+        """
+        if getattr(session, 'should_save', True):
+            return True
+        expires = getattr(session, 'expires', None)
+        if expires is None:
+            return getattr(session, 'permanent', False)
+        window = self.permanent_session_refresh_window
+        return expires - time() < window.days * 86400 + window.seconds
 
     def save_session(self, session, response):
-        """Saves the session if it needs updates.  For the default
-        implementation, check :meth:`open_session`.
+        """Saves the session.  This is called after the request if
+        :meth:`should_save_session` returns `True` and is forwarded to the
+        :attr:`session_interface`.  For the default implementation, check
+        :meth:`open_session`.
 
         :param session: the session to be saved (a
                         :class:`~werkzeug.contrib.securecookie.SecureCookie`
                         object)
         :param response: an instance of :attr:`response_class`
         """
-        expires = None
-        if session.permanent:
-            expires = datetime.utcnow() + self.permanent_session_lifetime
-        session.save_cookie(response, self.session_cookie_name,
-                            expires=expires, httponly=True)
+        self.session_interface.save_session(self, session, response)
 
     def register_module(self, module, **options):
         """Registers a module with this application.  The keyword argument
@@ -1165,6 +3478,7 @@ class Flask(_PackageBoundObject):
         state = _ModuleSetupState(self, **options)
         for func in module._register_events:
             func(state)
+        self.refresh_hooks()
 
     def add_url_rule(self, rule, endpoint=None, view_func=None, **options):
         """Connects a URL rule.  Works exactly like the :meth:`route`
@@ -1209,6 +3523,11 @@ class Flask(_PackageBoundObject):
         self.url_map.add(Rule(rule, **options))
         if view_func is not None:
             self.view_functions[endpoint] = view_func
+        self._dispatch_table = None
+        if self._url_adapter_cache is not None:
+            self._url_adapter_cache.clear()
+        if self._url_build_cache is not None:
+            self._url_build_cache.clear()
 
     def route(self, rule, **options):
         """A decorator that is used to register a view function for a
@@ -1300,6 +3619,7 @@ class Flask(_PackageBoundObject):
         """
         def decorator(f):
             self.error_handlers[code] = f
+            self._dispatch_table = None
             return f
         return decorator
 
@@ -1323,18 +3643,128 @@ class Flask(_PackageBoundObject):
     def before_request(self, f):
         """Registers a function to run before each request."""
         self.before_request_funcs.setdefault(None, []).append(f)
+        self.refresh_hooks()
         return f
 
     def after_request(self, f):
         """Register a function to be run after each request."""
         self.after_request_funcs.setdefault(None, []).append(f)
+        self.refresh_hooks()
         return f
 
     def context_processor(self, f):
         """Registers a template context processor function."""
         self.template_context_processors[None].append(f)
+        self.refresh_hooks()
         return f
 
+    def refresh_hooks(self):
+        """Merges the before request functions, after request functions
+        and template context processors again from
+        :attr:`before_request_funcs`, :attr:`after_request_funcs` and
+        :attr:`template_context_processors`.  The decorators that register
+        these functions call this automatically.  Functions that are added
+        to or removed from the dictionaries directly are noticed on the
+        next request as well, but if you replace a function in place you
+        have to call this method yourself.
+
+        .. versionadded:: 0.5
+        """
+        self._hook_chains_state = self._get_hook_state()
+        self._hook_chains = self._merge_hook_chains()
+        self._dispatch_table = None
+
+    def _get_hook_state(self):
+        # every hook list with its current length.  Comparing this to an
+        # older state is cheap for unchanged lists (identical objects) and
+        # notices functions that were added, removed or replaced lists.
+        return [(key, funcs, len(funcs))
+                for hooks in (self.before_request_funcs,
+                              self.after_request_funcs,
+                              self.template_context_processors)
+                for key, funcs in hooks.iteritems()]
+
+    def _merge_hook_chains(self):
+        before_app = tuple(self.before_request_funcs.get(None, ()))
+        after_app = tuple(self.after_request_funcs.get(None, ()))
+        processors_app = tuple(self.template_context_processors.get(None, ()))
+        rv = {None: (before_app, after_app, processors_app)}
+        modules = set(self.before_request_funcs)
+        modules.update(self.after_request_funcs)
+        modules.update(self.template_context_processors)
+        modules.discard(None)
+        for mod in modules:
+            rv[mod] = (
+                before_app + tuple(self.before_request_funcs.get(mod, ())),
+                tuple(self.after_request_funcs.get(mod, ())) + after_app,
+                processors_app +
+                    tuple(self.template_context_processors.get(mod, ()))
+            )
+        return rv
+
+    def get_hook_chains(self, module):
+        """Returns the before request functions, after request functions
+        and template context processors for requests handled by the given
+        module as tuple of tuples in the order they are called.
+
+        .. versionadded:: 0.5
+
+        :param module: the name of the module or `None`.
+        """
+        if self._hook_chains is None or \
+           self._get_hook_state() != self._hook_chains_state:
+            self.refresh_hooks()
+        chains = self._hook_chains
+        return chains.get(module) or chains[None]
+
+    def _current_hook_chains(self, module):
+        # like get_hook_chains but without comparing the hook state.  The
+        # state is already checked once per request in preprocess_request
+        # or when the dispatch record is looked up.
+        chains = self._hook_chains
+        if chains is None:
+            return self.get_hook_chains(module)
+        return chains.get(module) or chains[None]
+
+    def compile_dispatch(self):
+        """Builds the dispatch table used if :attr:`compiled_dispatch` is
+        enabled.  For every endpoint with a view function a record is
+        created that holds the view function, the flattened before and
+        after request functions for the endpoint's module and the error
+        handlers.
+
+        This is called automatically on the first request after a rule,
+        hook or error handler was registered or the request hook
+        dictionaries were changed.  If you modify :attr:`view_functions` or
+        :attr:`error_handlers` by hand, call this method again afterwards.
+
+        .. versionadded:: 0.5
+        """
+        error_handlers = dict(self.error_handlers)
+        table = {}
+        for endpoint, view_func in self.view_functions.iteritems():
+            mod = None
+            if '.' in endpoint:
+                mod = endpoint.rsplit('.', 1)[0]
+            before_funcs, after_funcs = self.get_hook_chains(mod)[:2]
+            table[endpoint] = _DispatchRecord(view_func, before_funcs,
+                                              after_funcs, error_handlers)
+        self._dispatch_table = table
+        return table
+
+    def get_dispatch_record(self, endpoint):
+        """Returns the compiled dispatch record for the given endpoint or
+        `None` if no view function is registered for it.  The dispatch
+        table is compiled first if necessary.
+
+        .. versionadded:: 0.5
+        """
+        table = self._dispatch_table
+        if table is None or \
+           self._get_hook_state() != self._hook_chains_state:
+            table = self.compile_dispatch()
+        return table.get(endpoint)
+
     def handle_http_exception(self, e):
         """Handles an HTTP exception.  By default this will invoke the
         registered error handlers and fall back to returning the
@@ -1342,7 +3772,11 @@ class Flask(_PackageBoundObject):
 
         .. versionadded: 0.3
         """
-        handler = self.error_handlers.get(e.code)
+        record = _request_ctx_stack.top.dispatch_record
+        if record is not None:
+            handler = record.error_handlers.get(e.code)
+        else:
+            handler = self.error_handlers.get(e.code)
         if handler is None:
             return e
         return handler(e)
@@ -1356,7 +3790,11 @@ class Flask(_PackageBoundObject):
 
         .. versionadded: 0.3
         """
-        handler = self.error_handlers.get(500)
+        record = _request_ctx_stack.top.dispatch_record
+        if record is not None:
+            handler = record.error_handlers.get(500)
+        else:
+            handler = self.error_handlers.get(500)
         if self.debug:
             raise
         self.logger.exception('Exception on %s [%s]' % (
@@ -1373,8 +3811,11 @@ class Flask(_PackageBoundObject):
         be a response object.  In order to convert the return value to a
         proper response object, call :func:`make_response`.
         """
-        req = _request_ctx_stack.top.request
+        ctx = _request_ctx_stack.top
+        req = ctx.request
         try:
+            if ctx.dispatch_record is not None:
+                return ctx.dispatch_record.view_func(**req.view_args)
             if req.routing_exception is not None:
                 raise req.routing_exception
             return self.view_functions[req.endpoint](**req.view_args)
@@ -1420,10 +3861,11 @@ class Flask(_PackageBoundObject):
         if it was the return value from the view and further
         request handling is stopped.
         """
-        funcs = self.before_request_funcs.get(None, ())
-        mod = request.module
-        if mod and mod in self.before_request_funcs:
-            funcs = chain(funcs, self.before_request_funcs[mod])
+        ctx = _request_ctx_stack.top
+        if ctx.dispatch_record is not None:
+            funcs = ctx.dispatch_record.before_request_funcs
+        else:
+            funcs = self.get_hook_chains(ctx.request.module)[0]
         for func in funcs:
             rv = func()
             if rv is not None:
@@ -1439,16 +3881,114 @@ class Flask(_PackageBoundObject):
                  instance of :attr:`response_class`.
         """
         ctx = _request_ctx_stack.top
-        mod = ctx.request.module
-        if not isinstance(ctx.session, _NullSession):
-            self.save_session(ctx.session, response)
-        funcs = ()
-        if mod and mod in self.after_request_funcs:
-            funcs = chain(funcs, self.after_request_funcs[mod])
-        if None in self.after_request_funcs:
-            funcs = chain(funcs, self.after_request_funcs[None])
+        session = ctx._session
+        if session is not None and not isinstance(session, _NullSession) \
+           and self.should_save_session(session):
+            self.save_session(session, response)
+        if ctx.dispatch_record is not None:
+            funcs = ctx.dispatch_record.after_request_funcs
+        else:
+            funcs = self._current_hook_chains(ctx.request.module)[1]
         for handler in funcs:
             response = handler(response)
+        if self.compress_responses:
+            response = self.compress_response(response)
+        # the config and the context are checked first, the status code
+        # and the method of werkzeug objects are parsed on every access
+        if (self.conditional_responses or
+            ctx.response_version is not None) and \
+           response.status_code == 200 and \
+           ctx.request.method in ('GET', 'HEAD'):
+            response = self.make_conditional(response)
+        return response
+
+    def compress_response(self, response):
+        """Compresses the body of a response with gzip or deflate if the
+        client accepts it.  Only responses with one of the
+        :attr:`compress_mimetypes` are compressed, bodies smaller than
+        :attr:`compress_min_size` and responses in direct passthrough mode
+        such as the ones from :func:`send_file` are left alone.  Streamed
+        bodies are compressed chunk by chunk while they are sent.  Called by
+        :meth:`process_response` if :attr:`compress_responses` is enabled.
+
+        .. versionadded:: 0.5
+
+        :param response: a :attr:`response_class` object.
+        :return: a new response object or the same, has to be an
+                 instance of :attr:`response_class`.
+        """
+        # only successful responses with a complete body are compressed.
+        # A 204 has no body and the Content-Range of a 206 refers to the
+        # uncompressed representation, compressing the part would make it
+        # impossible for the client to put the ranges together.
+        status = response.status_code
+        if response.direct_passthrough or \
+           not 200 <= status < 300 or status in (204, 206) or \
+           'content-encoding' in response.headers or \
+           response.mimetype not in self.compress_mimetypes:
+            return response
+        accept = request.accept_encodings
+        if accept['gzip']:
+            encoding = 'gzip'
+            wbits = 16 + zlib.MAX_WBITS
+        elif accept['deflate']:
+            encoding = 'deflate'
+            wbits = zlib.MAX_WBITS
+        else:
+            return response
+
+        level = self.compress_level
+        if response.is_sequence:
+            data = response.data
+            if len(data) < self.compress_min_size:
+                return response
+            compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+            data = compressor.compress(data) + compressor.flush()
+            response.response = [data]
+            if 'content-length' in response.headers:
+                response.headers['Content-Length'] = str(len(data))
+        else:
+            response.response = _compress_iter(response.response,
+                                               response.charset, level, wbits)
+            response.headers.pop('Content-Length', None)
+
+        response.headers['Content-Encoding'] = encoding
+        vary = response.headers.get('Vary')
+        if not vary:
+            response.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            response.headers['Vary'] = vary + ', Accept-Encoding'
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(etag, True)
+        return response
+
+    def make_conditional(self, response):
+        """Adds the version set by :func:`abort_if_not_modified` to a
+        response and, if :attr:`conditional_responses` is enabled, an
+        `ETag` computed from the body.  If the client already has that
+        version the status code is changed to ``304``.  Called by
+        :meth:`process_response` for successful ``GET`` and ``HEAD``
+        requests if conditional responses are enabled or a version was set.
+
+        .. versionadded:: 0.5
+
+        :param response: a :attr:`response_class` object.
+        :return: a new response object or the same, has to be an
+                 instance of :attr:`response_class`.
+        """
+        version = _request_ctx_stack.top.response_version
+        if version is not None:
+            _apply_response_version(response, version)
+        elif not self.conditional_responses:
+            return response
+        elif response.is_sequence and not response.direct_passthrough:
+            response.add_etag()
+        # werkzeug's make_conditional would buffer direct passthrough
+        # responses to update the content length, so check manually
+        if not _is_modified(request.environ, response.headers.get('etag'),
+                            response.headers.get('last-modified')):
+            response.status_code = 304
         return response
 
     def wsgi_app(self, environ, start_response):
@@ -1552,7 +4092,7 @@ class Flask(_PackageBoundObject):
 
 
 # context locals
-_request_ctx_stack = LocalStack()
+_request_ctx_stack = _ContextStack()
 # current_app, request, session, g 都是一个LocalProxy.
 
 # 应用级上下文：
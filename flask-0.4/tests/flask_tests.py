@@ -13,14 +13,20 @@ from __future__ import with_statement
 import os
 import re
 import sys
+import time
 import flask
 import unittest
+import shutil
+import threading
+import hashlib
 import tempfile
 from logging import StreamHandler
 from contextlib import contextmanager
-from datetime import datetime
-from werkzeug import parse_date, parse_options_header
+from datetime import datetime, timedelta
+from werkzeug import parse_date, parse_options_header, run_wsgi_app, \
+     create_environ
 from cStringIO import StringIO
+from io import BytesIO
 
 
 example_path = os.path.join(os.path.dirname(__file__), '..', 'examples')
@@ -107,6 +113,77 @@ class ContextTestCase(unittest.TestCase):
         else:
             raise AssertionError('some kind of exception expected')
 
+    def test_context_ident_func(self):
+        app = flask.Flask(__name__)
+        current = [None]
+        stack = flask._request_ctx_stack
+        old_ident_func = stack.__ident_func__
+        stack.__ident_func__ = lambda: current[0]
+
+        def worker(n):
+            with app.test_request_context('/?n=%d' % n):
+                flask.g.n = n
+                yield
+                assert flask.request.args['n'] == str(n)
+                assert flask.g.n == n
+                yield
+                assert flask.g.n == n
+
+        try:
+            # run 10000 request contexts interleaved in a single thread
+            workers = [worker(n) for n in xrange(10000)]
+            for x in xrange(3):
+                for n, gen in enumerate(workers):
+                    current[0] = n
+                    next(gen, None)
+            assert not stack._storage
+            current[0] = None
+            assert stack.top is None
+        finally:
+            stack.__ident_func__ = old_ident_func
+
+    def test_concurrent_request_contexts(self):
+        app = flask.Flask(__name__)
+        errors = []
+        def worker(n):
+            try:
+                for x in xrange(20):
+                    with app.test_request_context('/?n=%d' % n):
+                        flask.g.n = n
+                        time.sleep(0)
+                        assert flask.request.args['n'] == str(n)
+                        assert flask.g.n == n
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in xrange(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert not flask._request_ctx_stack._storage
+
+    def test_reap_dead_contexts(self):
+        app = flask.Flask(__name__)
+        stack = flask._request_ctx_stack
+        def leak():
+            app.test_request_context('/leaked').push()
+        thread = threading.Thread(target=leak)
+        thread.start()
+        thread.join()
+        # the thread may still be shutting down after join returned
+        while thread.ident in sys._current_frames():
+            time.sleep(0.001)
+        with app.test_request_context('/'):
+            stats = stack.__local_stats__()
+            assert stats['idents'] == 2
+            assert sorted(stats['depths'].values()) == [1, 1]
+            assert stack.__reap_local__(set(sys._current_frames())) == 1
+            assert stack.__local_stats__()['idents'] == 1
+            assert flask.request.path == '/'
+        assert stack.__local_stats__() == {'idents': 0, 'depths': {}}
+
 
 class BasicFunctionalityTestCase(unittest.TestCase):
 
@@ -172,6 +249,45 @@ class BasicFunctionalityTestCase(unittest.TestCase):
         assert c.post('/set', data={'value': '42'}).data == 'value set'
         assert c.get('/get').data == '42'
 
+    def test_lazy_session(self):
+        opened = []
+        saved = []
+        class LazyApp(flask.Flask):
+            def open_session(self, request):
+                opened.append(request.path)
+                return flask.Flask.open_session(self, request)
+            def save_session(self, session, response):
+                saved.append(flask.request.path)
+                flask.Flask.save_session(self, session, response)
+        app = LazyApp(__name__)
+        app.secret_key = 'testkey'
+        @app.route('/')
+        def index():
+            return 'index'
+        @app.route('/set')
+        def set():
+            flask.session['value'] = 42
+            return ''
+        @app.route('/get')
+        def get():
+            return str(flask.session['value'])
+        @app.route('/template')
+        def template():
+            return flask.render_template_string('{{ g }}')
+
+        c = app.test_client()
+        rv = c.get('/')
+        assert 'set-cookie' not in rv.headers
+        c.get('/template')
+        assert opened == []
+        rv = c.get('/set')
+        assert 'set-cookie' in rv.headers
+        rv = c.get('/get')
+        assert rv.data == '42'
+        assert 'set-cookie' not in rv.headers
+        assert opened == ['/set', '/get']
+        assert saved == ['/set']
+
     def test_missing_session(self):
         app = flask.Flask(__name__)
         def expect_exception(f, *args, **kwargs):
@@ -210,6 +326,51 @@ class BasicFunctionalityTestCase(unittest.TestCase):
         match = re.search(r'\bexpires=([^;]+)', rv.headers['set-cookie'])
         assert match is None
 
+    def test_session_change_tracking(self):
+        app = flask.Flask(__name__)
+        app.secret_key = 'testkey'
+        @app.route('/set/<value>')
+        def set(value):
+            flask.session['value'] = value
+            return ''
+        @app.route('/noop')
+        def noop():
+            flask.session['value'] = flask.session['value']
+            flask.session.pop('missing', None)
+            flask.session.permanent = False
+            flask.get_flashed_messages()
+            return ''
+
+        c = app.test_client()
+        assert 'set-cookie' in c.get('/set/42').headers
+        assert 'set-cookie' not in c.get('/set/42').headers
+        assert 'set-cookie' not in c.get('/noop').headers
+        assert 'set-cookie' in c.get('/set/23').headers
+
+    def test_permanent_session_refresh(self):
+        app = flask.Flask(__name__)
+        app.secret_key = 'testkey'
+        app.permanent_session_lifetime = timedelta(days=2)
+        @app.route('/login')
+        def login():
+            flask.session['user'] = 'joe'
+            flask.session.permanent = True
+            return ''
+        @app.route('/')
+        def index():
+            return flask.session['user']
+
+        c = app.test_client()
+        assert 'set-cookie' in c.get('/login').headers
+        rv = c.get('/')
+        assert rv.data == 'joe'
+        assert 'set-cookie' not in rv.headers
+        app.permanent_session_refresh_window = timedelta(days=3)
+        rv = c.get('/')
+        assert rv.data == 'joe'
+        assert 'set-cookie' in rv.headers
+        assert re.search(r'\bexpires=([^;]+)', rv.headers['set-cookie'])
+
     def test_flashes(self):
         app = flask.Flask(__name__)
         app.secret_key = 'testkey'
@@ -355,6 +516,306 @@ class BasicFunctionalityTestCase(unittest.TestCase):
             assert flask.url_for('hello', name='test x', _external=True) \
                 == 'http://localhost/hello/test%20x'
 
+    def test_url_adapter_cache(self):
+        app = flask.Flask(__name__)
+        app.url_adapter_cache_size = 2
+        @app.route('/')
+        def index():
+            return flask.url_for('index', _external=True)
+        @app.route('/folder/')
+        def folder():
+            return 'folder'
+        def adapter_for(*args, **kwargs):
+            with app.test_request_context(*args, **kwargs):
+                return flask._request_ctx_stack.top.url_adapter
+
+        c = app.test_client()
+        assert c.get('/').data == 'http://localhost/'
+        assert c.get('/', 'http://example.com/').data == 'http://example.com/'
+        rv = c.get('/folder', 'http://example.com/')
+        assert rv.status_code == 301
+        assert rv.headers['Location'] == 'http://example.com/folder/'
+        assert adapter_for('/') is adapter_for('/folder/')
+        assert adapter_for('/') is not adapter_for('/', 'http://example.com/')
+
+        adapter = adapter_for('/')
+        app.add_url_rule('/other', 'other', index)
+        assert len(app._url_adapter_cache) == 0
+        assert adapter_for('/') is not adapter
+
+        for host in 'a', 'b', 'c':
+            adapter_for('/', 'http://%s.example.com/' % host)
+        assert len(app._url_adapter_cache) == 2
+
+    def test_url_prefix_index(self):
+        def make_app(indexed):
+            app = flask.Flask(__name__)
+            app.url_prefix_index = indexed
+            def view(**kwargs):
+                return '%s %r' % (flask.request.endpoint,
+                                  sorted(kwargs.items()))
+            app.add_url_rule('/', 'index', view)
+            app.add_url_rule('/about', 'about', view)
+            app.add_url_rule('/users/', 'users', view)
+            app.add_url_rule('/users/<name>', 'user', view)
+            app.add_url_rule('/users/<name>/edit', 'edit', view,
+                             methods=['POST'])
+            app.add_url_rule('/page<int:num>', 'page', view)
+            app.add_url_rule('/files/<path:filename>', 'files', view)
+            app.add_url_rule('/<slug>', 'slug', view)
+            return app
+
+        paths = ['/', '/about', '/about/', '/users', '/users/',
+                 '/users/joe', '/users/joe/', '/users/joe/edit',
+                 '/page42', '/pagex', '/files/a/b/c.txt', '/files/',
+                 '/anything', '/no/such/page']
+        regular = make_app(False).test_client()
+        indexed = make_app(True).test_client()
+        for path in paths:
+            expected = regular.get(path)
+            rv = indexed.get(path)
+            assert rv.status_code == expected.status_code, path
+            assert rv.data == expected.data, path
+            assert rv.headers.get('Location') == \
+                expected.headers.get('Location'), path
+        assert indexed.post('/users/joe/edit').status_code == 200
+
+        app = make_app(True)
+        c = app.test_client()
+        assert c.get('/late').data.startswith('slug')
+        app.add_url_rule('/late', 'late', lambda: 'late')
+        assert c.get('/late').data == 'late'
+
+    def test_response_cache(self):
+        app = flask.Flask(__name__)
+        calls = []
+        @app.route('/', methods=['GET', 'POST'])
+        @flask.cache_response(headers=['X-Foo'], session=True)
+        def index():
+            calls.append(1)
+            return '%s|%d' % (flask.request.args.get('x', ''), len(calls))
+        @app.route('/vary')
+        @flask.cache_response(query_args=False)
+        def vary():
+            calls.append(1)
+            rv = app.response_class('%d' % len(calls))
+            rv.headers['Vary'] = 'Accept-Language'
+            return rv
+        @app.route('/cookie')
+        @flask.cache_response()
+        def cookie():
+            calls.append(1)
+            rv = app.response_class('%d' % len(calls))
+            rv.set_cookie('foo', 'bar')
+            return rv
+        c = app.test_client()
+
+        assert c.get('/').data == '|1'
+        rv = c.get('/')
+        assert rv.data == '|1'
+        assert rv.mimetype == 'text/html'
+        assert c.get('/?x=a').data == 'a|2'
+        assert c.get('/', headers=[('X-Foo', 'a')]).data == '|3'
+        assert c.post('/').data == '|4'
+        assert c.get('/', headers=[('Cookie', 'session=x')]).data == '|5'
+        assert c.get('/').data == '|1'
+        assert c.get('/?x=a').data == 'a|2'
+
+        del calls[:]
+        de = [('Accept-Language', 'de')]
+        assert c.get('/vary', headers=de).data == '1'
+        assert c.get('/vary').data == '2'
+        assert c.get('/vary', headers=de).data == '1'
+        rv = c.get('/vary?foo=bar')
+        assert rv.data == '2'
+        assert rv.headers['Vary'] == 'Accept-Language'
+
+        assert c.get('/cookie').data == '3'
+        assert c.get('/cookie').data == '4'
+
+        app.response_cache.clear()
+        assert c.get('/').data == '|5'
+
+        cache = flask.ResponseCache(max_size=1000, default_timeout=0)
+        with app.test_request_context():
+            headers = flask.request.headers
+            for x in xrange(3):
+                cache.set(x, headers, app.response_class('x' * 400))
+            assert cache.get(0, headers) is None
+            assert cache.get(2, headers).data == 'x' * 400
+            assert not cache.set(3, headers, app.response_class('x' * 1000))
+            assert cache.get(3, headers) is None
+
+    def test_response_cache_session(self):
+        app = flask.Flask(__name__)
+        app.secret_key = 'testkey'
+        @app.route('/login/<name>')
+        def login(name):
+            flask.session['name'] = name
+            flask.flash('hello %s' % name)
+            return ''
+        @app.route('/')
+        @flask.cache_response()
+        def index():
+            return flask.render_template_string('{{ session.name }}|'
+                '{{ get_flashed_messages()|join(",") }}')
+        calls = []
+        @app.route('/per-session')
+        @flask.cache_response(session=True)
+        def per_session():
+            calls.append(1)
+            return '%s|%d' % (flask.session.get('name'), len(calls))
+
+        alice = app.test_client()
+        bob = app.test_client()
+        alice.get('/login/alice')
+        bob.get('/login/bob')
+        assert alice.get('/').data == 'alice|hello alice'
+        assert bob.get('/').data == 'bob|hello bob'
+        assert alice.get('/').data == 'alice|'
+        assert bob.get('/').data == 'bob|'
+
+        assert alice.get('/per-session').data == 'alice|1'
+        assert bob.get('/per-session').data == 'bob|2'
+        assert alice.get('/per-session').data == 'alice|1'
+        assert bob.get('/per-session').data == 'bob|2'
+
+    def test_conditional_responses(self):
+        app = flask.Flask(__name__)
+        @app.route('/')
+        def index():
+            return 'Hello World'
+        c = app.test_client()
+        rv = c.get('/')
+        assert 'ETag' not in rv.headers
+
+        app.config['CONDITIONAL_RESPONSES'] = True
+        rv = c.get('/')
+        etag = rv.headers['ETag']
+        assert rv.status_code == 200
+        rv = c.get('/', headers=[('If-None-Match', etag)])
+        assert rv.status_code == 304
+        assert rv.data == ''
+        assert c.post('/', headers=[('If-None-Match', etag)]) \
+            .status_code == 405
+
+    def test_abort_if_not_modified(self):
+        app = flask.Flask(__name__)
+        calls = []
+        modified = datetime(2010, 7, 1, 12, 0, 0, 500)
+        @app.route('/', methods=['GET', 'POST'])
+        def index():
+            flask.abort_if_not_modified(etag='v1', last_modified=modified)
+            calls.append(1)
+            return 'Hello World'
+        c = app.test_client()
+        rv = c.get('/')
+        assert rv.headers['ETag'] == '"v1"'
+        assert rv.headers['Last-Modified'] == 'Thu, 01 Jul 2010 12:00:00 GMT'
+        rv = c.get('/', headers=[('If-None-Match', '"v1"')])
+        assert rv.status_code == 304
+        assert rv.headers['ETag'] == '"v1"'
+        rv = c.get('/', headers=[('If-Modified-Since',
+                                  'Thu, 01 Jul 2010 12:00:00 GMT')])
+        assert rv.status_code == 304
+        assert c.get('/', headers=[('If-None-Match', '"v0"')]) \
+            .status_code == 200
+        assert c.post('/', headers=[('If-None-Match', '"v1"')]) \
+            .status_code == 200
+        assert len(calls) == 3
+
+    def test_response_compression(self):
+        import zlib
+        app = flask.Flask(__name__)
+        app.config['COMPRESS_RESPONSES'] = True
+        app.config['COMPRESS_LEVEL'] = 9
+        body = 'Hello World! ' * 100
+        @app.route('/')
+        def index():
+            flask.abort_if_not_modified(etag='v1')
+            return body
+        @app.route('/small')
+        def small():
+            return 'Hello World!'
+        @app.route('/partial')
+        def partial():
+            return app.response_class(body, 206)
+        @app.route('/json')
+        def json():
+            return flask.stream_jsonify('items', xrange(1000))
+        @app.route('/file')
+        def file():
+            return flask.send_file('static/index.html',
+                                   mimetype='text/plain')
+        c = app.test_client()
+        gzip = [('Accept-Encoding', 'gzip, deflate')]
+
+        rv = c.get('/', headers=gzip)
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert rv.headers['Vary'] == 'Accept-Encoding'
+        assert rv.get_etag() == ('v1', True)
+        assert int(rv.headers['Content-Length']) == len(rv.data) < 100
+        assert zlib.decompress(rv.data, 16 + zlib.MAX_WBITS) == body
+        rv = c.get('/', headers=gzip + [('If-None-Match', 'W/"v1"')])
+        assert rv.status_code == 304
+        rv = c.get('/', headers=[('Accept-Encoding', 'deflate')])
+        assert rv.headers['Content-Encoding'] == 'deflate'
+        assert zlib.decompress(rv.data) == body
+        rv = c.get('/')
+        assert 'Content-Encoding' not in rv.headers
+        assert rv.data == body
+        assert rv.get_etag() == ('v1', False)
+
+        rv = c.get('/small', headers=gzip)
+        assert 'Content-Encoding' not in rv.headers
+        rv = c.get('/partial', headers=gzip)
+        assert 'Content-Encoding' not in rv.headers
+        assert rv.data == body
+        rv = c.get('/file', headers=gzip)
+        assert 'Content-Encoding' not in rv.headers
+        rv = c.get('/json', headers=gzip)
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in rv.headers
+        assert flask.json.loads(zlib.decompress(rv.data, 16 +
+            zlib.MAX_WBITS)) == {'items': range(1000)}
+
+        app.config['COMPRESS_RESPONSES'] = False
+        assert c.get('/', headers=gzip).data == body
+
+    def test_url_build_cache(self):
+        app = flask.Flask(__name__)
+        app.url_build_cache_size = 10
+        @app.route('/hello/<name>')
+        def hello(name):
+            pass
+        with app.test_request_context():
+            assert flask.url_for('hello', name='x') == '/hello/x'
+            assert flask.url_for('hello', name='x') == '/hello/x'
+            assert flask.url_for('hello', name='x', _external=True) \
+                == 'http://localhost/hello/x'
+            assert flask.url_for('hello', name='x', q=['a', 'b']) \
+                == '/hello/x?q=a&q=b'
+            assert flask.url_for('static', filename='a.css') \
+                == '/static/a.css'
+        assert app.url_build_cache_hits == 1
+        assert app.url_build_cache_misses == 3
+
+        with app.test_request_context('/', 'http://example.com/app/',
+                                      method='POST'):
+            assert flask.url_for('hello', name='x') == '/app/hello/x'
+            assert flask.url_for('static', filename='a.css') \
+                == '/app/static/a.css'
+        with app.test_request_context('/', 'http://example.com/',
+                                      method='POST'):
+            assert flask.url_for('hello', name='x', _external=True) \
+                == 'http://example.com/hello/x'
+            assert flask.url_for('static', filename='a.css') \
+                == '/static/a.css'
+        assert app.url_build_cache_hits == 2
+
+        app.add_url_rule('/other', 'other')
+        assert len(app._url_build_cache) == 0
+
     def test_custom_converters(self):
         from werkzeug.routing import BaseConverter
         class ListConverter(BaseConverter):
@@ -380,6 +841,173 @@ class BasicFunctionalityTestCase(unittest.TestCase):
             assert flask.url_for('static', filename='index.html') \
                 == '/static/index.html'
 
+    def test_static_file_handler(self):
+        app = flask.Flask(__name__)
+        static_folder = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(static_folder, 'css'))
+            def write(filename, contents):
+                f = open(os.path.join(static_folder, filename), 'wb')
+                f.write(contents)
+                f.close()
+            write('css/style.css', 'body { color: red }')
+            write('css/style.css.gz', 'compressed')
+            app.static_files.directory = static_folder
+            app.static_cache_timeout = 60
+            c = app.test_client()
+
+            rv = c.get('/static/css/style.css')
+            assert rv.data == 'body { color: red }'
+            assert rv.mimetype == 'text/css'
+            assert rv.headers['Cache-Control'] == 'public, max-age=60'
+            assert rv.headers['Vary'] == 'Accept-Encoding'
+            assert 'Content-Encoding' not in rv.headers
+            rv = c.get('/static/css/style.css', headers=[
+                ('If-None-Match', rv.headers['ETag'])])
+            assert rv.status_code == 304
+            rv = c.get('/static/css/style.css', headers=[
+                ('Accept-Encoding', 'gzip, deflate')])
+            assert rv.data == 'compressed'
+            assert rv.headers['Content-Encoding'] == 'gzip'
+            assert rv.mimetype == 'text/css'
+            assert c.head('/static/css/style.css').data == ''
+
+            assert c.get('/static/../flask_tests.py').status_code == 404
+            assert c.get('/static/css/../../flask_tests.py') \
+                .status_code == 404
+            assert c.get('/static/missing.css').status_code == 404
+            assert c.post('/static/css/style.css').status_code == 404
+
+            # replaced and removed files are noticed outside of debug mode
+            write('css/print.css', 'a { }')
+            assert c.get('/static/css/print.css').data == 'a { }'
+            write('css/print.css', 'a { color: black }')
+            rv = c.get('/static/css/print.css')
+            assert rv.data == 'a { color: black }'
+            assert rv.headers['Content-Length'] == str(len(rv.data))
+            os.remove(os.path.join(static_folder, 'css/print.css'))
+            assert c.get('/static/css/print.css').status_code == 404
+
+            app.static_fingerprints = True
+            with app.test_request_context():
+                url = flask.url_for('static', filename='css/style.css')
+                assert re.match(r'^/static/css/style\.[0-9a-f]{12}\.css$',
+                                url)
+                assert flask.url_for('static', filename='missing.css') == \
+                    '/static/missing.css'
+            rv = c.get(url)
+            assert rv.data == 'body { color: red }'
+            assert rv.headers['Cache-Control'] == 'public, max-age=31536000'
+            rv = c.get('/static/css/style.000000000000.css')
+            assert rv.headers['Cache-Control'] == 'public, max-age=60'
+
+            # filenames from templates are unicode strings
+            try:
+                write(u'caf\xe9.css'.encode(sys.getfilesystemencoding()),
+                      'p { }')
+            except UnicodeError:
+                pass
+            else:
+                with app.test_request_context():
+                    unicode_url = flask.url_for('static',
+                                                filename=u'caf\xe9.css')
+                assert re.match(r'^/static/caf%C3%A9\.[0-9a-f]{12}\.css$',
+                                unicode_url)
+                assert c.get(unicode_url).data == 'p { }'
+
+            app.debug = True
+            write('css/style.css', 'body { color: blue }')
+            with app.test_request_context():
+                assert flask.url_for('static', filename='css/style.css') \
+                    != url
+            assert c.get(url).data == 'body { color: blue }'
+        finally:
+            shutil.rmtree(static_folder)
+
+    def test_static_manifest(self):
+        app = flask.Flask(__name__)
+        static_folder = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(static_folder, 'js'))
+            for filename in 'js/app.js', 'js/app.js.gz', 'robots.txt':
+                f = open(os.path.join(static_folder, filename), 'wb')
+                f.write(filename)
+                f.close()
+            app.static_files.directory = static_folder
+            app.static_fingerprints = True
+            app.static_manifest = os.path.join(static_folder, 'manifest')
+            assert app.static_files.get_manifest() is None
+
+            # a missing manifest is remembered outside of debug mode
+            other = flask.Flask(__name__)
+            other.static_files.directory = static_folder
+            other.static_manifest = app.static_manifest
+            other.static_files.build_manifest()
+            assert app.static_files.get_manifest() is None
+            app.debug = True
+            assert app.static_files.get_manifest() is not None
+            app.debug = False
+            os.remove(app.static_manifest)
+            app.static_files.clear()
+            assert app.static_files.get_manifest() is None
+
+            manifest = app.static_files.build_manifest()
+            assert sorted(manifest) == ['js/app.js', 'robots.txt']
+            assert manifest['robots.txt'] == \
+                hashlib.md5('robots.txt').hexdigest()[:12]
+
+            # a second application loads the manifest instead of hashing
+            app = flask.Flask(__name__)
+            app.static_files.directory = static_folder
+            app.static_fingerprints = True
+            app.static_manifest = os.path.join(static_folder, 'manifest')
+            assert app.static_files.get_manifest() == manifest
+            os.remove(os.path.join(static_folder, 'robots.txt'))
+            with app.test_request_context():
+                url = flask.url_for('static', filename='robots.txt')
+                assert url == '/static/robots.%s.txt' % manifest['robots.txt']
+                url = flask.url_for('static', filename='js/app.js')
+                assert url == '/static/js/app.%s.js' % manifest['js/app.js']
+                assert flask.url_for('static', filename='manifest') == \
+                    '/static/manifest'
+            rv = app.test_client().get(url)
+            assert rv.data == 'js/app.js'
+            assert rv.headers['Cache-Control'] == 'public, max-age=31536000'
+        finally:
+            shutil.rmtree(static_folder)
+
+    def test_compiled_dispatch(self):
+        app = flask.Flask(__name__)
+        app.compiled_dispatch = True
+        evts = []
+        @app.before_request
+        def before_request():
+            evts.append('before')
+        @app.route('/')
+        def index():
+            return 'index'
+        @app.route('/missing')
+        def missing():
+            flask.abort(404)
+        c = app.test_client()
+        assert c.get('/').data == 'index'
+        assert evts == ['before']
+        assert app._dispatch_table is not None
+
+        @app.after_request
+        def after_request(response):
+            response.data += '|after'
+            return response
+        @app.errorhandler(404)
+        def not_found(e):
+            return 'not found', 404
+        assert app._dispatch_table is None
+        assert c.get('/').data == 'index|after'
+        rv = c.get('/missing')
+        assert rv.status_code == 404
+        assert rv.data == 'not found|after'
+        assert c.get('/nowhere').data == 'not found|after'
+
     def test_none_response(self):
         app = flask.Flask(__name__)
         @app.route('/')
@@ -394,6 +1022,114 @@ class BasicFunctionalityTestCase(unittest.TestCase):
             assert "Expected ValueError"
 
 
+class SessionStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_stores(self):
+        yield flask.MemorySessionStore()
+        yield flask.FileSessionStore(os.path.join(self.path, 'files'))
+        if flask.sqlite3 is not None:
+            yield flask.SQLiteSessionStore(os.path.join(self.path, 'db'))
+
+    def test_store_session_interface(self):
+        for store in self.make_stores():
+            app = flask.Flask(__name__)
+            app.session_interface = flask.StoreSessionInterface(store)
+            @app.route('/set/<value>')
+            def set(value):
+                flask.session['value'] = value
+                return ''
+            @app.route('/get')
+            def get():
+                return flask.session.get('value', 'missing')
+            @app.route('/clear')
+            def clear():
+                flask.session.clear()
+                return ''
+
+            c = app.test_client()
+            rv = c.get('/set/42')
+            sid = re.search(r'session=([a-f0-9]{40});',
+                            rv.headers['set-cookie']).group(1)
+            assert store.load(sid)[0] == {'value': u'42'}
+            rv = c.get('/get')
+            assert rv.data == '42'
+            assert 'set-cookie' not in rv.headers
+            rv = c.get('/set/23')
+            assert 'set-cookie' not in rv.headers
+            assert c.get('/get').data == '23'
+            c.get('/clear')
+            assert store.load(sid) is None
+            assert c.get('/get').data == 'missing'
+            assert app.test_client().get('/get').data == 'missing'
+
+    def test_store_sweep(self):
+        for store in self.make_stores():
+            now = int(time.time())
+            for x in xrange(5):
+                store.save('%040d' % x, {'x': x}, now - 10)
+            store.save('%040d' % 5, {'x': 5}, now + 100)
+            assert store.sweep(batch_size=2) == 2
+            assert store.sweep() == 3
+            assert store.sweep() == 0
+            assert store.load('%040d' % 0) is None
+            assert store.load('%040d' % 5) == ({'x': 5}, now + 100)
+
+
+class SessionSerializerTestCase(unittest.TestCase):
+
+    def test_tagged_json_serializer(self):
+        serializer = flask.TaggedJSONSerializer()
+        values = [42, u'Hällo', 'ascii', '\xff\x00', (1, (2, u'x')),
+                  [1, (2, 3)], {'a': (1,), 'b': {' t': 1}},
+                  flask.Markup(u'<em>Hi</em>'),
+                  datetime(2010, 6, 18, 12, 30, 15, 42), None, True]
+        for value in values:
+            rv = serializer.loads(serializer.dumps(value))
+            assert rv == value
+            assert type(rv) is type(value) or isinstance(value, str)
+        assert serializer.dumps({'a': [1, 2]}) == '{"a":[1,2]}'
+
+    def test_compressed_serializer(self):
+        serializer = flask.CompressedSerializer(flask.TaggedJSONSerializer(),
+                                                threshold=20)
+        assert serializer.dumps(42) == '42'
+        value = [u'a flashed message'] * 20
+        dumped = serializer.dumps(value)
+        assert dumped.startswith('.')
+        assert len(dumped) < len(flask.json.dumps(value))
+        assert serializer.loads(dumped) == value
+
+    def test_session_with_serializer(self):
+        app = flask.Flask(__name__)
+        app.secret_key = 'testkey'
+        app.session_serializer = flask.CompressedSerializer(
+            flask.TaggedJSONSerializer(), threshold=20)
+        @app.route('/')
+        def index():
+            flask.session['user_id'] = 42
+            flask.session['pair'] = (1, 2)
+            for x in xrange(10):
+                flask.flash(flask.Markup(u'<em>Hello</em>'))
+            return ''
+        @app.route('/test')
+        def test():
+            assert flask.session['user_id'] == 42
+            assert flask.session['pair'] == (1, 2)
+            messages = flask.get_flashed_messages()
+            assert messages == [u'<em>Hello</em>'] * 10
+            assert isinstance(messages[0], flask.Markup)
+            return 'ok'
+        c = app.test_client()
+        c.get('/')
+        assert c.get('/test').data == 'ok'
+
+
 class JSONTestCase(unittest.TestCase):
 
     def test_jsonify(self):
@@ -421,6 +1157,87 @@ class JSONTestCase(unittest.TestCase):
                             content_type='application/json')
         assert rv.data == '3'
 
+    def test_json_backend(self):
+        app = flask.Flask(__name__)
+        class Point(object):
+            def __init__(self, x, y):
+                self.x, self.y = x, y
+        class Point3D(Point):
+            pass
+        app.json_backend.add_encoder(Point, lambda p: [p.x, p.y])
+        other = flask.Flask(__name__)
+        assert other.json_backend is not app.json_backend
+        assert Point not in other.json_backend.encoders
+        @app.route('/')
+        def index():
+            return flask.jsonify(date=datetime(2010, 7, 1, 12, 0, 0),
+                                 point=Point3D(1, 2))
+        c = app.test_client()
+        rv = c.get('/')
+        assert rv.data == '{"date":"Thu, 01 Jul 2010 12:00:00 GMT",' \
+                          '"point":[1,2]}'
+        app.config['JSONIFY_INDENT'] = 2
+        rv = c.get('/')
+        assert '\n  "point"' in rv.data
+        assert flask.json.loads(rv.data)['point'] == [1, 2]
+        try:
+            app.json_backend.dumps(object())
+        except TypeError:
+            pass
+        else:
+            assert False, 'expected type error'
+
+        class UpperJSON(object):
+            def loads(self, s):
+                return flask.json.loads(s.upper())
+        app.json_backend = flask.JSONBackend(UpperJSON())
+        @app.route('/echo', methods=['POST'])
+        def echo():
+            return flask.request.json['A']
+        rv = c.post('/echo', data='{"a": "b"}',
+                    content_type='application/json')
+        assert rv.data == 'B'
+
+    def test_stream_jsonify(self):
+        app = flask.Flask(__name__)
+        @app.route('/')
+        def index():
+            def generate():
+                for x in xrange(250):
+                    yield {'id': x, 'name': flask.request.args['name']}
+            return flask.stream_jsonify('items', generate(), count=250)
+        @app.route('/empty')
+        def empty():
+            return flask.stream_jsonify('items', [])
+        app_iter, status, headers = run_wsgi_app(app,
+            create_environ('/?name=foo'))
+        assert dict(headers)['Content-Type'] == 'application/json'
+        chunks = list(app_iter)
+        assert len(chunks) == 5
+        data = flask.json.loads(''.join(chunks))
+        assert data['count'] == 250
+        assert data['items'] == [{'id': x, 'name': 'foo'}
+                                 for x in xrange(250)]
+        rv = app.test_client().get('/empty')
+        assert rv.data == '{"items":[]}'
+
+        class PrettyJSON(flask.JSONBackend):
+            def dumps(self, obj, indent=None):
+                return flask.JSONBackend.dumps(self, obj, indent=2) + '\n'
+        app.json_backend = PrettyJSON()
+        rv = run_wsgi_app(app, create_environ('/?name=foo'))[0]
+        data = flask.json.loads(''.join(rv))
+        assert data['count'] == 250
+        assert len(data['items']) == 250
+
+        with app.test_request_context():
+            try:
+                flask.stream_jsonify('items', [], items=1)
+            except TypeError:
+                pass
+            else:
+                assert False, 'expected type error'
+
     def test_template_escaping(self):
         app = flask.Flask(__name__)
         render = flask.render_template_string
@@ -507,6 +1324,102 @@ class TemplatingTestCase(unittest.TestCase):
         rv = app.test_client().get('/')
         assert rv.data == 'dcba'
 
+    def test_streaming_templates(self):
+        app = flask.Flask(__name__)
+        app.config['TEMPLATE_STREAM_BUFFER_SIZE'] = 0
+        @app.route('/')
+        def index():
+            return flask.stream_template_string('{% for x in range(3) %}'
+                '{{ request.args.name }}{{ x }}{% endfor %}'
+                '{{ url_for("index") }}')
+        app_iter, status, headers = run_wsgi_app(app,
+            create_environ('/?name=x'))
+        assert flask._request_ctx_stack.top is None
+        assert dict(headers)['Content-Type'] == 'text/html; charset=utf-8'
+        assert list(app_iter) == ['x', '0', 'x', '1', 'x', '2', '/']
+        assert flask._request_ctx_stack.top is None
+
+        app.config['TEMPLATE_STREAM_BUFFER_SIZE'] = 3
+        app_iter = run_wsgi_app(app, create_environ('/?name=y'))[0]
+        assert list(app_iter) == ['y0y', '1y2', '/']
+
+        with app.test_request_context('/?name=z'):
+            rv = flask.stream_template('context_template.html', value=23)
+            assert rv.data == '<p>23|'
+
+    def test_fragment_cache(self):
+        app = flask.Flask(__name__)
+        app.config['FRAGMENT_CACHE_TIMEOUT'] = 0
+        calls = []
+        def counter():
+            calls.append(1)
+            return len(calls)
+        template = '{% call cache_fragment("nav", id) %}' \
+            '{{ counter() }}<br>{% endcall %}'
+        with app.test_request_context():
+            rv = [flask.render_template_string(template, counter=counter,
+                                               id=x) for x in 1, 1, 2]
+            assert rv == ['1<br>', '1<br>', '2<br>']
+            cache = app.fragment_cache
+            assert cache.get((None, 'nav', 1)) == '1<br>'
+            cache.delete((None, 'nav', 1))
+            assert flask.render_template_string(template, counter=counter,
+                                                id=1) == '3<br>'
+
+            assert cache.get_or_set(('x',), counter, timeout=0.1) == 4
+            assert cache.get_or_set(('x',), counter) == 4
+            time.sleep(0.15)
+            assert cache.get(('x',)) is None
+            cache.clear()
+            assert cache.get((None, 'nav', 2)) is None
+
+    def test_precompile_templates(self):
+        bytecode_cache = flask.MemoryBytecodeCache()
+        class MyFlask(flask.Flask):
+            def create_jinja_bytecode_cache(self):
+                return bytecode_cache
+        app = MyFlask(__name__)
+        assert app.jinja_env.bytecode_cache is bytecode_cache
+        rv = app.precompile_templates(lambda x: 'filter' not in x)
+        assert sorted(rv) == ['_macro.html', 'context_template.html',
+                              'escaping_template.html']
+        assert len(bytecode_cache._cache) == 3
+
+        # a second application loads the code from the cache
+        app = MyFlask(__name__)
+        def fail(*args, **kwargs):
+            raise AssertionError('template was compiled again')
+        app.jinja_env.compile = fail
+        app.jinja_env.get_template('context_template.html')
+        assert app.precompile_templates(lambda x: x == '_macro.html') == \
+            ['_macro.html']
+
+        bytecode_cache.clear()
+        assert len(bytecode_cache._cache) == 0
+
+    def test_request_cacheable_context_processors(self):
+        called = []
+        app = flask.Flask(__name__)
+        @app.context_processor
+        @flask.request_cacheable
+        def inject_cached():
+            called.append('cached')
+            return dict(cached=42)
+        @app.context_processor
+        def inject_uncached():
+            called.append('uncached')
+            return dict(uncached=23)
+        @app.route('/')
+        def index():
+            return flask.render_template_string('{{ cached }}|') + \
+                   flask.render_template_string('{{ uncached }}')
+        c = app.test_client()
+        assert c.get('/').data == '42|23'
+        assert called == ['cached', 'uncached', 'uncached']
+        del called[:]
+        assert c.get('/').data == '42|23'
+        assert called == ['cached', 'uncached', 'uncached']
+
 
 class ModuleTestCase(unittest.TestCase):
 
@@ -567,6 +1480,85 @@ class ModuleTestCase(unittest.TestCase):
         assert catched == ['before-app', 'before-admin',
                            'after-admin', 'after-app']
 
+    def test_compiled_request_processing(self):
+        catched = []
+        app = flask.Flask(__name__)
+        app.compiled_dispatch = True
+        admin = flask.Module(__name__, 'admin', url_prefix='/admin')
+        @admin.before_request
+        def before_admin_request():
+            catched.append('before-admin')
+        @admin.after_request
+        def after_admin_request(response):
+            catched.append('after-admin')
+            return response
+        @admin.route('/')
+        def index():
+            return 'the admin'
+        @app.before_request
+        def before_request():
+            catched.append('before-app')
+        @app.after_request
+        def after_request(response):
+            catched.append('after-app')
+            return response
+        @app.route('/')
+        def index():
+            return 'the index'
+        app.register_module(admin)
+        c = app.test_client()
+
+        assert c.get('/').data == 'the index'
+        assert catched == ['before-app', 'after-app']
+        del catched[:]
+
+        assert c.get('/admin/').data == 'the admin'
+        assert catched == ['before-app', 'before-admin',
+                           'after-admin', 'after-app']
+
+    def test_late_hook_registration(self):
+        catched = []
+        app = flask.Flask(__name__)
+        admin = flask.Module(__name__, 'admin', url_prefix='/admin')
+        @admin.route('/')
+        def index():
+            return 'the admin'
+        app.register_module(admin)
+        c = app.test_client()
+
+        assert c.get('/admin/').data == 'the admin'
+        assert catched == []
+
+        @app.before_request
+        def before_request():
+            catched.append('before-app')
+        assert c.get('/admin/').data == 'the admin'
+        assert catched == ['before-app']
+        del catched[:]
+
+        app.before_request_funcs.setdefault('admin', []).append(
+            lambda: catched.append('before-admin'))
+        assert c.get('/admin/').data == 'the admin'
+        assert catched == ['before-app', 'before-admin']
+        del catched[:]
+
+        app.after_request_funcs['admin'] = [
+            lambda response: catched.append('after-admin') or response]
+        assert c.get('/admin/').data == 'the admin'
+        assert catched == ['before-app', 'before-admin', 'after-admin']
+        del catched[:]
+
+        app.compiled_dispatch = True
+        app.before_request_funcs[None].append(
+            lambda: catched.append('before-app-2'))
+        assert c.get('/admin/').data == 'the admin'
+        assert catched == ['before-app', 'before-app-2', 'before-admin',
+                           'after-admin']
+        before, after, processors = app.get_hook_chains('admin')
+        assert before == tuple(app.before_request_funcs[None] +
+                               app.before_request_funcs['admin'])
+        assert app.get_hook_chains('missing') == app.get_hook_chains(None)
+
     def test_context_processors(self):
         app = flask.Flask(__name__)
         admin = flask.Module(__name__, 'admin', url_prefix='/admin')
@@ -646,6 +1638,26 @@ class SendfileTestCase(unittest.TestCase):
                 os.path.join(app.root_path, 'static/index.html')
             assert rv.mimetype == 'text/html'
 
+    def test_send_file_unicode_filename(self):
+        app = flask.Flask(__name__)
+        try:
+            u'caf\xe9'.encode(sys.getfilesystemencoding() or 'ascii')
+        except UnicodeError:
+            self.skipTest('filesystem encoding cannot store the filename')
+        folder = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(folder.decode('ascii'), u'caf\xe9.txt')
+            f = open(filename, 'wb')
+            f.write('caf\xc3\xa9')
+            f.close()
+            with app.test_request_context():
+                rv = flask.send_file(filename)
+                assert rv.status_code == 200
+                assert rv.data == 'caf\xc3\xa9'
+                assert rv.headers['ETag']
+        finally:
+            shutil.rmtree(folder)
+
     def test_send_file_object(self):
         app = flask.Flask(__name__)
         with app.test_request_context():
@@ -675,12 +1687,78 @@ class SendfileTestCase(unittest.TestCase):
             assert rv.data == 'Test'
             assert rv.mimetype == 'text/plain'
 
+        with app.test_request_context():
+            rv = flask.send_file(BytesIO('Test'), mimetype='text/plain')
+            assert rv.status_code == 200
+            assert rv.data == 'Test'
+            assert 'Content-Length' not in rv.headers
+
+        with app.test_request_context():
+            f = open(os.path.join(app.root_path, 'static/index.html'))
+            f.read(5)
+            rv = flask.send_file(f)
+            with app.open_resource('static/index.html') as f:
+                expected = f.read()[5:]
+            assert rv.data == expected
+            assert rv.headers.get('Content-Length') in (None,
+                                                        str(len(expected)))
+
         app.use_x_sendfile = True
         with app.test_request_context():
             f = StringIO('Test')
             rv = flask.send_file(f)
             assert 'x-sendfile' not in rv.headers
 
+    def test_send_file_conditional(self):
+        app = flask.Flask(__name__)
+        @app.route('/')
+        def index():
+            return flask.send_file('static/index.html')
+        with app.open_resource('static/index.html') as f:
+            contents = f.read()
+        c = app.test_client()
+        rv = c.get('/')
+        assert rv.data == contents
+        assert rv.headers['Content-Length'] == str(len(contents))
+        assert rv.headers['Accept-Ranges'] == 'bytes'
+        etag = rv.headers['ETag']
+        last_modified = rv.headers['Last-Modified']
+
+        rv = c.get('/', headers=[('If-None-Match', etag)])
+        assert rv.status_code == 304
+        assert rv.data == ''
+        rv = c.get('/', headers=[('If-Modified-Since', last_modified)])
+        assert rv.status_code == 304
+
+        rv = c.get('/', headers=[('Range', 'bytes=2-5')])
+        assert rv.status_code == 206
+        assert rv.data == contents[2:6]
+        assert rv.headers['Content-Range'] == 'bytes 2-5/%d' % len(contents)
+        assert rv.headers['Content-Length'] == '4'
+        rv = c.get('/', headers=[('Range', 'bytes=5-')])
+        assert rv.data == contents[5:]
+        rv = c.get('/', headers=[('Range', 'bytes=-3')])
+        assert rv.data == contents[-3:]
+        rv = c.get('/', headers=[('Range', 'bytes=%d-' % len(contents))])
+        assert rv.status_code == 416
+        assert rv.headers['Content-Range'] == 'bytes */%d' % len(contents)
+        rv = c.get('/', headers=[('Range', 'bytes=0-1,4-5')])
+        assert rv.status_code == 200
+        assert rv.data == contents
+
+        rv = c.get('/', headers=[('Range', 'bytes=2-5'), ('If-Range', etag)])
+        assert rv.status_code == 206
+        rv = c.get('/', headers=[('Range', 'bytes=2-5'),
+                                 ('If-Range', '"other"')])
+        assert rv.status_code == 200
+        assert rv.data == contents
+
+        with app.test_request_context(headers=[('Range', 'bytes=2-5')]):
+            rv = flask.send_file('static/index.html', add_etags=False,
+                                 conditional=False)
+            assert rv.status_code == 200
+            assert 'ETag' not in rv.headers
+
     def test_attachment(self):
         app = flask.Flask(__name__)
         with app.test_request_context():
@@ -842,6 +1920,9 @@ def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(ContextTestCase))
     suite.addTest(unittest.makeSuite(BasicFunctionalityTestCase))
+    suite.addTest(unittest.makeSuite(SessionStoreTestCase))
+    if flask.json_available:
+        suite.addTest(unittest.makeSuite(SessionSerializerTestCase))
     suite.addTest(unittest.makeSuite(TemplatingTestCase))
     suite.addTest(unittest.makeSuite(ModuleTestCase))
     suite.addTest(unittest.makeSuite(SendfileTestCase))
@@ -8,10 +8,13 @@
     :copyright: (c) 2014 by the Werkzeug Team, see AUTHORS for more details.
     :license: BSD, see LICENSE for more details.
 """
+import sys
 import copy
+from time import time
+from weakref import WeakValueDictionary
 from functools import update_wrapper
 from werkzeug.wsgi import ClosingIterator
-from werkzeug._compat import PY2, implements_bool
+from werkzeug._compat import PY2, implements_bool, integer_types
 
 # since each thread has its own greenlet we can just use those as identifiers
 # for the context.  If greenlets are not available we fall back to the
@@ -24,6 +27,53 @@ except ImportError:
     except ImportError:
         from _thread import get_ident
 
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
+
+if ContextVar is not None:
+    _context_ident = ContextVar('local.context_ident')
+
+    def get_context_ident():
+        """Locals that use this function as ident function keep their
+        values in a :class:`~contextvars.ContextVar` instead of a dict keyed
+        by ident.  That way coroutines that run in the same thread are told
+        apart, as every asyncio task (and every greenlet of a recent
+        greenlet version) runs in its own copy of the contextvars context.
+        A task sees the values that were set where it was started, but
+        values it sets itself are not visible to other tasks::
+
+            manager = LocalManager([stack], ident_func=get_context_ident)
+
+        Called directly it returns an identifier for the current context
+        that is created the first time it is asked for.  Contexts that are
+        copied from there on (for example tasks started afterwards) share
+        the identifier.
+
+        If :mod:`contextvars` is not available this is the greenlet or
+        thread ident that :func:`get_ident` returns.
+        """
+        rv = _context_ident.get(None)
+        if rv is None:
+            rv = object()
+            _context_ident.set(rv)
+        return rv
+
+    # the ident function that switches locals to contextvars storage
+    _context_ident_func = get_context_ident
+else:
+    get_context_ident = get_ident
+    _context_ident_func = None
+
+
+class _ContextStorage(dict):
+    # the values of a local in one contextvars context.  Dicts cannot be
+    # weakly referenced, this subclass can, so that the storages which
+    # are still alive can be tracked.
+    __slots__ = ('__weakref__',)
+
 
 def release_local(local):
     """Releases the contents of the local for the current context.
@@ -48,12 +98,57 @@ def release_local(local):
     local.__release_local__()
 
 
+def local_stats(local):
+    """Returns a dict with information about the data held by a
+    :class:`Local` or :class:`LocalStack`.  The ``'idents'`` key is the
+    number of contexts that currently have data in the local.  For stacks
+    the ``'depths'`` key maps the ident of each of those contexts to the
+    number of items on its stack.
+
+    This is useful to find contexts that were never cleaned up, for
+    example request contexts that were kept around for debugging::
+
+        >>> ls = LocalStack()
+        >>> ls.push(42)
+        >>> local_stats(ls)['idents']
+        1
+    """
+    return local.__local_stats__()
+
+
+def reap_local(local):
+    """Releases the data a :class:`Local` or :class:`LocalStack` holds for
+    contexts that no longer exist and returns how many were released.
+    Thread idents are checked against the threads that are still running
+    and greenlets are released once they are dead.  Data stored for other
+    kinds of idents is left alone.
+    """
+    return local.__reap_local__(set(sys._current_frames()))
+
+
+def _is_dead_ident(ident, live_threads):
+    if isinstance(ident, integer_types):
+        return ident not in live_threads
+    return getattr(ident, 'dead', False)
+
+
 class Local(object):
-    __slots__ = ('__storage__', '__ident_func__')
+    __slots__ = ('__storage__', '__ident_func__', '__context_storage__',
+                 '__context_storages__')
 
     def __init__(self):
         object.__setattr__(self, '__storage__', {})
         object.__setattr__(self, '__ident_func__', get_ident)
+        # only used with get_context_ident as ident function.  Every change
+        # stores a copy of the values, so that the contexts which were
+        # copied from the current one keep seeing the old values.
+        if ContextVar is not None:
+            object.__setattr__(self, '__context_storage__',
+                               ContextVar('local.storage'))
+        else:
+            object.__setattr__(self, '__context_storage__', None)
+        object.__setattr__(self, '__context_storages__',
+                           WeakValueDictionary())
 
     def __iter__(self):
         return iter(self.__storage__.items())
@@ -63,15 +158,46 @@ class Local(object):
         return LocalProxy(self, proxy)
 
     def __release_local__(self):
-        self.__storage__.pop(self.__ident_func__(), None)
+        if self.__ident_func__ is _context_ident_func:
+            self.__context_storage__.set(None)
+        else:
+            self.__storage__.pop(self.__ident_func__(), None)
+
+    def __local_stats__(self):
+        return {'idents': len(self.__storage__) +
+                          len(self.__context_storages__)}
+
+    def __reap_local__(self, live_threads):
+        # storages of contextvars contexts go away with their contexts
+        storage = self.__storage__
+        dead = [ident for ident in list(storage)
+                if _is_dead_ident(ident, live_threads)]
+        for ident in dead:
+            storage.pop(ident, None)
+        return len(dead)
+
+    def __set_context_values__(self, values):
+        storage = _ContextStorage(values)
+        self.__context_storages__[id(storage)] = storage
+        self.__context_storage__.set(storage)
 
     def __getattr__(self, name):
+        if self.__ident_func__ is _context_ident_func:
+            storage = self.__context_storage__.get(None)
+            if storage is not None and name in storage:
+                return storage[name]
+            raise AttributeError(name)
         try:
             return self.__storage__[self.__ident_func__()][name]
         except KeyError:
             raise AttributeError(name)
 
     def __setattr__(self, name, value):
+        if self.__ident_func__ is _context_ident_func:
+            values = dict(self.__context_storage__.get(None) or ())
+            values[name] = value
+            self.__set_context_values__(values)
+            return
         ident = self.__ident_func__()
         storage = self.__storage__
         try:
@@ -80,6 +206,13 @@ class Local(object):
             storage[ident] = {name: value}
 
     def __delattr__(self, name):
+        if self.__ident_func__ is _context_ident_func:
+            values = dict(self.__context_storage__.get(None) or ())
+            if name not in values:
+                raise AttributeError(name)
+            del values[name]
+            self.__set_context_values__(values)
+            return
         try:
             del self.__storage__[self.__ident_func__()][name]
         except KeyError:
@@ -116,10 +249,24 @@ class LocalStack(object):
 
     def __init__(self):
         self._local = Local()
+        # the storage dict of the local never changes, so it is kept
+        # around to look up the stack of the context directly
+        self._storage = self._local.__storage__
 
     def __release_local__(self):
         self._local.__release_local__()
 
+    def __local_stats__(self):
+        # contextvars storages have no ident, their id is used instead
+        storages = list(self._storage.items())
+        storages.extend(self._local.__context_storages__.items())
+        depths = dict((ident, len(storage.get('stack') or ()))
+                      for ident, storage in storages)
+        return {'idents': len(depths), 'depths': depths}
+
+    def __reap_local__(self, live_threads):
+        return self._local.__reap_local__(live_threads)
+
     def _get__ident_func__(self):
         return self._local.__ident_func__
 
@@ -136,9 +283,22 @@ class LocalStack(object):
             return rv
         return LocalProxy(_lookup)
 
+    def _get_stack(self):
+        local = self._local
+        if local.__ident_func__ is _context_ident_func:
+            return getattr(local, 'stack', None)
+        storage = self._storage.get(local.__ident_func__())
+        if storage is not None:
+            return storage.get('stack')
+
     def push(self, obj):
         """Pushes a new item to the stack"""
-        rv = getattr(self._local, 'stack', None)
+        rv = self._get_stack()
+        if self._local.__ident_func__ is _context_ident_func:
+            # the stack may be shared with the contexts that were copied
+            # from this one, so it is never modified in place
+            self._local.stack = rv = (rv or []) + [obj]
+            return rv
         if rv is None:
             self._local.stack = rv = []
         rv.append(obj)
@@ -148,12 +308,15 @@ class LocalStack(object):
         """Removes the topmost item from the stack, will return the
         old value or `None` if the stack was already empty.
         """
-        stack = getattr(self._local, 'stack', None)
-        if stack is None:
+        stack = self._get_stack()
+        if not stack:
             return None
         elif len(stack) == 1:
             release_local(self._local)
             return stack[-1]
+        elif self._local.__ident_func__ is _context_ident_func:
+            self._local.stack = stack[:-1]
+            return stack[-1]
         else:
             return stack.pop()
 
@@ -162,10 +325,20 @@ class LocalStack(object):
         """The topmost item on the stack.  If the stack is empty,
         `None` is returned.
         """
-        try:
-            return self._local.stack[-1]
-        except (AttributeError, IndexError):
-            return None
+        # inlined version of _get_stack; this is looked up for every
+        # attribute access on a proxy so it avoids the method call and
+        # the exception of the empty stack.
+        local = self._local
+        ident_func = local.__ident_func__
+        if ident_func is _context_ident_func:
+            storage = local.__context_storage__.get(None)
+        else:
+            storage = self._storage.get(ident_func())
+        if storage is not None:
+            stack = storage.get('stack')
+            if stack:
+                return stack[-1]
+        return None
 
 
 class LocalManager(object):
@@ -176,7 +349,12 @@ class LocalManager(object):
     it, will clean up all the data left in the locals for this context.
 
     The `ident_func` parameter can be added to override the default ident
-    function for the wrapped locals.
+    function for the wrapped locals.  To keep the contexts of coroutines
+    that share a thread apart pass :func:`get_context_ident`.
+
+    If `reap_interval` is set to a number of seconds, :meth:`cleanup` also
+    releases the data of contexts that died without being cleaned up (see
+    :meth:`reap`), at most once per interval.
 
     .. versionchanged:: 0.6.1
        Instead of a manager the :func:`release_local` function can be used
@@ -186,10 +364,10 @@ class LocalManager(object):
        `ident_func` was added.
     """
 
-    def __init__(self, locals=None, ident_func=None):
+    def __init__(self, locals=None, ident_func=None, reap_interval=None):
         if locals is None:
             self.locals = []
-        elif isinstance(locals, Local):
+        elif isinstance(locals, (Local, LocalStack)):
             self.locals = [locals]
         else:
             self.locals = list(locals)
@@ -199,6 +377,8 @@ class LocalManager(object):
                 object.__setattr__(local, '__ident_func__', ident_func)
         else:
             self.ident_func = get_ident
+        self.reap_interval = reap_interval
+        self.last_reap = time()
 
     def get_ident(self):
         """Return the context identifier the local objects use internally for
@@ -219,6 +399,22 @@ class LocalManager(object):
         """
         for local in self.locals:
             release_local(local)
+        if self.reap_interval is not None and \
+           time() - self.last_reap >= self.reap_interval:
+            self.reap()
+
+    def stats(self):
+        """Return a list with the :func:`local_stats` of all the locals."""
+        return [local_stats(local) for local in self.locals]
+
+    def reap(self):
+        """Release the data that threads and greenlets which are gone left
+        in the locals and return how many contexts were released.
+        """
+        self.last_reap = time()
+        live_threads = set(sys._current_frames())
+        return sum(local.__reap_local__(live_threads)
+                   for local in self.locals)
 
     def make_middleware(self, app):
         """Wrap a WSGI application so that cleaning up happens after
@@ -250,6 +446,25 @@ class LocalManager(object):
         )
 
 
+def snapshot(obj):
+    """Resolves a :class:`LocalProxy` to the object it currently points to.
+    Other objects are returned unchanged.  Every operation on a proxy has to
+    look up the object again, so code that touches a proxy very often (for
+    example in a loop) can resolve it once and work with the real object::
+
+        req = snapshot(request)
+        for key in keys:
+            if key in req.args:
+                ...
+
+    The returned object is bound to the current context, so it must not
+    be kept around after the context ended.
+    """
+    if isinstance(obj, LocalProxy):
+        return obj._get_current_object()
+    return obj
+
+
 @implements_bool
 class LocalProxy(object):
 
@@ -287,23 +502,30 @@ class LocalProxy(object):
     .. versionchanged:: 0.6.1
        The class can be instanciated with a callable as well now.
     """
-    __slots__ = ('__local', '__dict__', '__name__')
+    __slots__ = ('__local', '__dict__', '__name__', '__lookup')
 
     def __init__(self, local, name=None):
         object.__setattr__(self, '_LocalProxy__local', local)
         object.__setattr__(self, '__name__', name)
+        # figure out once how the object is looked up instead of checking
+        # the type of the local on every operation
+        if hasattr(local, '__release_local__'):
+            def lookup():
+                try:
+                    return getattr(local, name)
+                except AttributeError:
+                    raise RuntimeError('no object bound to %s' % name)
+        else:
+            lookup = local
+        object.__setattr__(self, '_LocalProxy__lookup', lookup)
 
     def _get_current_object(self):
         """Return the current object.  This is useful if you want the real
         object behind the proxy at a time for performance reasons or because
-        you want to pass the object into a different context.
+        you want to pass the object into a different context.  See also
+        :func:`snapshot`.
         """
-        if not hasattr(self.__local, '__release_local__'):
-            return self.__local()
-        try:
-            return getattr(self.__local, self.__name__)
-        except AttributeError:
-            raise RuntimeError('no object bound to %s' % self.__name__)
+        return self.__lookup()
 
     @property
     def __dict__(self):
@@ -340,7 +562,18 @@ class LocalProxy(object):
     def __getattr__(self, name):
         if name == '__members__':
             return dir(self._get_current_object())
-        return getattr(self._get_current_object(), name)
+        return getattr(self.__lookup(), name)
+
+    # the most common operations call the lookup function directly to
+    # save the method call of _get_current_object
+    def __getitem__(self, key):
+        return self.__lookup()[key]
+
+    def __contains__(self, item):
+        return item in self.__lookup()
+
+    def __iter__(self):
+        return iter(self.__lookup())
 
     def __setitem__(self, key, value):
         self._get_current_object()[key] = value
@@ -370,9 +603,6 @@ class LocalProxy(object):
     __hash__ = lambda x: hash(x._get_current_object())
     __call__ = lambda x, *a, **kw: x._get_current_object()(*a, **kw)
     __len__ = lambda x: len(x._get_current_object())
-    __getitem__ = lambda x, i: x._get_current_object()[i]
-    __iter__ = lambda x: iter(x._get_current_object())
-    __contains__ = lambda x, i: i in x._get_current_object()
     __add__ = lambda x, o: x._get_current_object() + o
     __sub__ = lambda x, o: x._get_current_object() - o
     __mul__ = lambda x, o: x._get_current_object() * o
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+    Context Local Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the throughput of the context locals in :mod:`local`: plain
+    attribute access on a :class:`Local`, looking up the top of a
+    :class:`LocalStack` with and without a bound object and attribute
+    access through a :class:`LocalProxy` to the top of a stack, which is
+    what every ``request.x`` and ``g.x`` boils down to.  The common item
+    operations on a proxy are compared to the same operations on an
+    object resolved once with :func:`snapshot`.
+
+    :copyright: (c) 2014 by the Werkzeug Team, see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+from timeit import repeat
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from local import Local, LocalStack, snapshot
+
+
+ROUNDS = 300000
+
+
+class Request(dict):
+    path = '/'
+
+
+def bench(func):
+    best = min(repeat(func, number=ROUNDS, repeat=5))
+    return ROUNDS / best
+
+
+def main():
+    local = Local()
+    local.value = 42
+    stack = LocalStack()
+    proxy = stack()
+
+    results = [('Local attribute', bench(lambda: local.value)),
+               ('LocalStack.top (empty)', bench(lambda: stack.top))]
+    stack.push(Request(key=42))
+    results.append(('LocalStack.top', bench(lambda: stack.top)))
+    results.append(('LocalProxy attribute', bench(lambda: proxy.path)))
+    results.append(('LocalProxy getitem', bench(lambda: proxy['key'])))
+    results.append(('LocalProxy contains', bench(lambda: 'key' in proxy)))
+    results.append(('LocalProxy iter', bench(lambda: iter(proxy))))
+    obj = snapshot(proxy)
+    results.append(('snapshot attribute', bench(lambda: obj.path)))
+    results.append(('snapshot getitem', bench(lambda: obj['key'])))
+    stack.pop()
+
+    for name, ops in results:
+        print('%-24s %10.0f ops/s' % (name, ops))
+
+
+if __name__ == '__main__':
+    main()
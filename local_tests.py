@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+    Context Local Tests
+    ~~~~~~~~~~~~~~~~~~~
+
+    Tests the context locals in :mod:`local`.
+
+    :copyright: (c) 2014 by the Werkzeug Team, see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import sys
+import time
+import unittest
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import local
+
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+class LocalStackTestCase(unittest.TestCase):
+
+    def check_stack(self, stack):
+        idents = local.local_stats(stack)['idents']
+        assert stack.top is None
+        assert stack.pop() is None
+        stack.push(42)
+        stack.push(23)
+        assert stack.top == 23
+        assert stack.pop() == 23
+        assert stack.top == 42
+        assert stack.pop() == 42
+        assert stack.top is None
+        assert stack.pop() is None
+        assert local.local_stats(stack)['idents'] == idents
+
+    def test_push_pop(self):
+        self.check_stack(local.LocalStack())
+
+    def test_custom_ident_func(self):
+        stack = local.LocalStack()
+        ident = [1]
+        local.LocalManager([stack], ident_func=lambda: ident[0])
+        self.check_stack(stack)
+        stack.push(42)
+        ident[0] = 2
+        self.check_stack(stack)
+        ident[0] = 1
+        assert stack.top == 42
+
+    @unittest.skipIf(contextvars is None, 'contextvars not available')
+    def test_context_ident_func(self):
+        stack = local.LocalStack()
+        local.LocalManager([stack], ident_func=local.get_context_ident)
+        contextvars.copy_context().run(self.check_stack, stack)
+
+    def test_empty_stack(self):
+        stack = local.LocalStack()
+        stack.push(42)
+        del stack._local.stack[:]
+        assert stack.top is None
+        assert stack.pop() is None
+        stack.push(23)
+        assert stack.top == 23
+
+    def test_release(self):
+        stack = local.LocalStack()
+        stack.push(42)
+        stack.push(23)
+        local.release_local(stack)
+        assert stack.top is None
+        assert stack.pop() is None
+
+    def test_proxy(self):
+        stack = local.LocalStack()
+        proxy = stack()
+        self.assertRaises(RuntimeError, lambda: proxy.real)
+        stack.push(42)
+        assert proxy.real == 42
+        stack.pop()
+        self.assertRaises(RuntimeError, lambda: proxy.real)
+
+
+class LocalProxyTestCase(unittest.TestCase):
+
+    def test_local_proxy_items(self):
+        loc = local.Local()
+        proxy = loc('data')
+        self.assertRaises(RuntimeError, lambda: proxy['key'])
+        self.assertRaises(RuntimeError, lambda: 'key' in proxy)
+        self.assertRaises(RuntimeError, lambda: iter(proxy))
+        loc.data = {'key': 42}
+        assert proxy['key'] == 42
+        self.assertRaises(KeyError, lambda: proxy['missing'])
+        assert 'key' in proxy
+        assert 'missing' not in proxy
+        assert list(proxy) == ['key']
+        proxy['other'] = 23
+        del proxy['key']
+        assert loc.data == {'other': 23}
+
+    def test_stack_proxy_items(self):
+        stack = local.LocalStack()
+        proxy = stack()
+        self.assertRaises(RuntimeError, lambda: proxy[0])
+        stack.push([1, 2, 3])
+        assert proxy[0] == 1
+        assert proxy[-1] == 3
+        assert 2 in proxy
+        assert list(proxy) == [1, 2, 3]
+        stack.push([4])
+        assert list(proxy) == [4]
+        stack.pop()
+        assert list(proxy) == [1, 2, 3]
+
+    def test_function_proxy_items(self):
+        data = {'key': 42}
+        proxy = local.LocalProxy(lambda: data)
+        assert proxy['key'] == 42
+        assert 'key' in proxy
+        assert list(proxy) == ['key']
+
+    def test_snapshot(self):
+        stack = local.LocalStack()
+        proxy = stack()
+        self.assertRaises(RuntimeError, local.snapshot, proxy)
+        obj = {'key': 42}
+        stack.push(obj)
+        resolved = local.snapshot(proxy)
+        assert resolved is obj
+        assert local.snapshot(obj) is obj
+        assert local.snapshot(None) is None
+        stack.pop()
+        self.assertRaises(RuntimeError, lambda: proxy['key'])
+        assert resolved['key'] == 42
+
+
+class ConcurrencyTestCase(unittest.TestCase):
+
+    def test_threads(self):
+        loc = local.Local()
+        stack = local.LocalStack()
+        errors = []
+        def worker(n):
+            try:
+                for x in range(20):
+                    loc.value = n
+                    stack.push(n)
+                    assert stack.top == n
+                    assert loc.value == n
+                    assert stack.pop() == n
+                local.release_local(loc)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert list(loc) == []
+        assert stack.top is None
+
+    @unittest.skipIf(contextvars is None, 'contextvars not available')
+    def test_contexts(self):
+        loc = local.Local()
+        stack = local.LocalStack()
+        manager = local.LocalManager([loc, stack],
+                                     ident_func=local.get_context_ident)
+        # the values of the parent are inherited by the copied contexts,
+        # what they set themselves must stay in their own context
+        loc.value = 'parent'
+        stack.push('parent')
+        def task(n):
+            assert loc.value == 'parent'
+            assert stack.top == 'parent'
+            loc.value = n
+            stack.push(n)
+            yield
+            assert loc.value == n
+            assert stack.top == n
+            assert stack.pop() == n
+            assert stack.top == 'parent'
+            yield
+        tasks = []
+        for n in range(10000):
+            gen = task(n)
+            context = contextvars.copy_context()
+            context.run(next, gen)
+            tasks.append((context, gen))
+        for context, gen in tasks:
+            context.run(next, gen)
+        assert loc.value == 'parent'
+        assert stack.top == 'parent'
+        assert stack.pop() == 'parent'
+        assert stack.top is None
+        del tasks, context, gen
+        manager.cleanup()
+        assert manager.stats() == [{'idents': 0},
+                                   {'idents': 0, 'depths': {}}]
+
+
+class StatsTestCase(unittest.TestCase):
+
+    def leak(self, *locals):
+        def worker():
+            for loc in locals:
+                if isinstance(loc, local.LocalStack):
+                    loc.push(42)
+                else:
+                    loc.value = 42
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        # the thread may still be shutting down after join returned
+        while thread.ident in sys._current_frames():
+            time.sleep(0.001)
+
+    def test_local_stats(self):
+        loc = local.Local()
+        stack = local.LocalStack()
+        assert local.local_stats(loc) == {'idents': 0}
+        assert local.local_stats(stack) == {'idents': 0, 'depths': {}}
+        loc.value = 42
+        stack.push(1)
+        stack.push(2)
+        self.leak(loc, stack)
+        assert local.local_stats(loc) == {'idents': 2}
+        stats = local.local_stats(stack)
+        assert stats['idents'] == 2
+        assert stats['depths'][local.get_ident()] == 2
+        assert sorted(stats['depths'].values()) == [1, 2]
+
+    def test_reap_local(self):
+        loc = local.Local()
+        stack = local.LocalStack()
+        loc.value = 42
+        stack.push(42)
+        self.leak(loc, stack)
+        assert local.reap_local(loc) == 1
+        assert local.reap_local(stack) == 1
+        assert local.reap_local(stack) == 0
+        assert loc.value == 42
+        assert stack.top == 42
+
+    def test_reap_greenlets(self):
+        class Greenlet(object):
+            dead = False
+        greenlet = Greenlet()
+        loc = local.Local()
+        local.LocalManager([loc], ident_func=lambda: greenlet)
+        loc.value = 42
+        assert local.reap_local(loc) == 0
+        greenlet.dead = True
+        assert local.reap_local(loc) == 1
+        assert local.local_stats(loc) == {'idents': 0}
+
+    def test_manager_reap_interval(self):
+        stack = local.LocalStack()
+        manager = local.LocalManager([stack], reap_interval=3600)
+        self.leak(stack)
+        manager.cleanup()
+        assert manager.stats()[0]['idents'] == 1
+        manager.last_reap -= 3600
+        manager.cleanup()
+        assert manager.stats()[0]['idents'] == 0
+        self.leak(stack)
+        assert manager.reap() == 1
+
+    @unittest.skipIf(contextvars is None, 'contextvars not available')
+    def test_context_storage_collected(self):
+        stack = local.LocalStack()
+        local.LocalManager([stack], ident_func=local.get_context_ident)
+        contexts = [contextvars.copy_context() for x in range(10)]
+        for context in contexts:
+            context.run(stack.push, 42)
+        stats = local.local_stats(stack)
+        assert stats['idents'] == 10
+        assert list(stats['depths'].values()) == [1] * 10
+        del contexts, context
+        assert local.local_stats(stack)['idents'] == 0
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LocalStackTestCase))
+    suite.addTest(unittest.makeSuite(LocalProxyTestCase))
+    suite.addTest(unittest.makeSuite(ConcurrencyTestCase))
+    suite.addTest(unittest.makeSuite(StatsTestCase))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')